@@ -0,0 +1,47 @@
+import random
+import timeit
+
+from tree import Tree
+from tree.server import TreeServer
+
+ITEMS = 100000
+BATCH = 32
+REPEATS = 5
+
+
+def workloads():
+    """Batches of intersect queries as they arrive from many clients at once."""
+    batches = {}
+    for size in (10, 100):
+        batch = []
+        for _ in range(BATCH):
+            x, y = random.uniform(0, 900), random.uniform(0, 900)
+            batch.append(((x, y, x + size, y + size), -1))
+        batches["scattered %d" % size] = batch
+    batches["clustered"] = [((400 + random.uniform(0, 50), 400 + random.uniform(0, 50),
+                              450 + random.uniform(0, 50), 450 + random.uniform(0, 50)), -1) for _ in range(BATCH)]
+    batches["same region"] = [((400 + random.uniform(0, 5), 400, 500 + random.uniform(0, 5), 500), -1)
+                              for _ in range(BATCH)]
+    return batches
+
+
+def main():
+    random.seed(1234)
+    tree = Tree((0, 0, 1000, 1000))
+    for i in range(ITEMS):
+        x, y = random.uniform(0, 1000), random.uniform(0, 1000)
+        w = random.choice([0, 0, random.uniform(0, 5)])
+        tree.insert(i, (x, y, x + w, y + w))
+    # The traversal is called directly, leaving the socket and protocol out of the timings
+    server = TreeServer(tree, "unused.sock")
+
+    print("%-14s %10s %10s %6s" % ("workload", "batched", "separate", "ratio"))
+    for name, batch in workloads().items():
+        batched = min(timeit.repeat(lambda: server._intersect_batch(batch), number=1, repeat=REPEATS))
+        separate = min(timeit.repeat(lambda: [list(tree.intersect(bbox, mask)) for bbox, mask in batch],
+                                     number=1, repeat=REPEATS))
+        print("%-14s %8.2fms %8.2fms %6.2f" % (name, batched * 1000, separate * 1000, batched / separate))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,8 @@ import time
 import numpy as np
 import pygame
 
-from tree import Tree, Quadtree
+from tree.quadtree import Quadtree
+from tree.query_window import QueryWindow
 
 RADIUS = 20
 
@@ -20,6 +21,9 @@ def main():
     end = time.time()
     print(end-start)
 
+    # Consecutive windows overlap almost entirely, only the difference is queried each frame
+    window = QueryWindow(quadtree)
+
     pygame.init()
     screen = pygame.display.set_mode([500, 500])
     running = True
@@ -41,8 +45,9 @@ def main():
 
         #mouse_pos = np.array([256, 256])
         screen.fill((255, 255, 255))
+        window.move((*(mouse_pos - radius), *(mouse_pos + radius)))
         item_count = 0
-        for item, point in quadtree.intersect(*(mouse_pos - radius), *(mouse_pos + radius)):
+        for item, point in window.items:
             item_count += 1
             pygame.draw.circle(screen, (255, 0, 0), point, 1)
             pass
@@ -0,0 +1,11 @@
+class TreeConfig:
+    """Settings shared by every node of a tree.
+
+    Nodes hold a reference to a single TreeConfig instead of their own copies,
+    so changing the capacity of a tree is a single assignment.
+    """
+    __slots__ = ("capacity", "max_depth")
+
+    def __init__(self, capacity: int = 10, max_depth: int = 20):
+        self.capacity = capacity
+        self.max_depth = max_depth
@@ -0,0 +1,119 @@
+import math
+from typing import Tuple
+
+import numpy
+
+# Items are counted once, at the position of their center. The center of an item
+# follows a single path down the tree: at every split it goes to the high child of a
+# dimension if it is not below the split, to the low child otherwise. Every node thereby
+# owns a half-open region [low, high) of centers, unbounded at the edges of the tree,
+# and `count` is the number of items stored in the subtree whose center lies in it.
+# Items inserted with a mask of 0 match no query and are left out of the counts.
+# None marks a count not known yet, computed on demand by `_subtree_count`. Inserts
+# only update the counts once the root count is known, so trees that never call
+# density pay nothing for them; density computes the root count first, which leaves
+# no known count below an unknown root. Grid cells are half-open the same way as
+# nodes, so nodes aligned with the grid fall within a single cell.
+
+
+def count_insert(root, bbox):
+    """Adds an item inserted in the tree to the counts of the nodes on its center path."""
+    dims = len(root.center)
+    low, high = _bounds(bbox, dims)
+    center = [(low[j] + high[j]) / 2 for j in range(dims)]
+    node = root
+    while True:
+        if node.count is not None:
+            node.count += 1
+        if not node.children:
+            return
+        # Items overlapping the center of a node are stored in the node itself
+        if all(low[j] <= node.center[j] <= high[j] for j in range(dims)):
+            return
+        split = _bounds(node.children[-1].bbox, dims)[0]
+        node = node.children[sum(bit for j, bit in enumerate(node._child_bits) if center[j] >= split[j])]
+
+
+def density(tree, bbox, shape: Tuple[int, ...], mask: int = -1) -> numpy.ndarray:
+    """Counts the items of a tree in each cell of a regular grid, see `Quadtree.density`."""
+    dims = len(shape)
+    query = numpy.ravel(numpy.asarray(bbox, dtype=float)).tolist()
+    q_low, q_high = query[:dims], query[dims:]
+    # Grid axes are in reverse dimension order, like the rows and columns of an image
+    cells = tuple(reversed(shape))
+    size = [(q_high[j] - q_low[j]) / cells[j] for j in range(dims)]
+    grid = numpy.zeros(shape, dtype=numpy.int64)
+    _subtree_count(tree, [-math.inf] * dims, [math.inf] * dims)
+
+    def cell(point):
+        index = []
+        for j in range(dims):
+            if not q_low[j] <= point[j] <= q_high[j]:
+                return None
+            k = int((point[j] - q_low[j]) / size[j]) if size[j] else 0
+            index.append(min(k, cells[j] - 1))
+        return tuple(reversed(index))
+
+    nodes = [(tree, [-math.inf] * dims, [math.inf] * dims)]
+    while nodes:
+        node, low, high = nodes.pop()
+        if not node.mask & mask:
+            continue
+        if any(low[j] > q_high[j] or high[j] <= q_low[j] for j in range(dims)):
+            continue
+        if not node.mask & ~mask and all(low[j] >= q_low[j] and high[j] <= q_high[j] for j in range(dims)):
+            # Every item owned by the node matches the mask, use the count if they share a cell
+            index = cell(low)
+            if index == cell([math.nextafter(h, -math.inf) for h in high]):
+                grid[index] += _subtree_count(node, low, high)
+                continue
+        if node.children:
+            for i, child in enumerate(node.children):
+                nodes.append((child, *_child_region(node, i, low, high)))
+        for _, pt, obj_mask in node.points or ():
+            if obj_mask & mask:
+                center = _owned_center(pt, low, high)
+                if center is not None:
+                    index = cell(center)
+                    if index is not None:
+                        grid[index] += 1
+    return grid
+
+
+def _subtree_count(node, low, high) -> int:
+    if node.count is None:
+        count = sum(1 for _, pt, obj_mask in node.points or ()
+                    if obj_mask and _owned_center(pt, low, high) is not None)
+        for i, child in enumerate(node.children or ()):
+            count += _subtree_count(child, *_child_region(node, i, low, high))
+        node.count = count
+    return node.count
+
+
+def _child_region(node, index: int, low, high):
+    """Region of centers owned by a child, given the region of its parent."""
+    dims = len(low)
+    split = _bounds(node.children[-1].bbox, dims)[0]
+    child_low, child_high = list(low), list(high)
+    for j, bit in enumerate(node._child_bits):
+        if index & bit:
+            child_low[j] = split[j]
+        else:
+            child_high[j] = split[j]
+    return child_low, child_high
+
+
+def _owned_center(bbox, low, high):
+    """Center of an entry if it lies in the region [low, high), None otherwise."""
+    dims = len(low)
+    b_low, b_high = _bounds(bbox, dims)
+    center = [(b_low[j] + b_high[j]) / 2 for j in range(dims)]
+    if all(low[j] <= center[j] < high[j] for j in range(dims)):
+        return center
+    return None
+
+
+def _bounds(bbox, dims: int):
+    if isinstance(bbox, numpy.ndarray) and bbox.ndim == 2:
+        return bbox[0].tolist(), bbox[1].tolist()
+    return bbox[:dims], bbox[dims:]
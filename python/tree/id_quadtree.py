@@ -0,0 +1,357 @@
+import math
+from array import array
+from typing import Tuple, Optional, List
+
+import numpy
+
+from .config import TreeConfig
+from .quadtree import Quadtree
+
+
+class IdQuadtree:
+    """Quadtree storing integer ids in typed arrays instead of Python objects.
+
+    Meant for items that are rows of NumPy or pandas tables: each node keeps the ids of
+    its entries in an int64 array and their bounding boxes in a flat float64 array, and
+    `intersect_ids` returns the ids of a query as one `ndarray[int64]`, ready to be used
+    for fancy indexing.
+
+    The nodes have no Python object entries, so the tree wraps its own node type rather
+    than extending Quadtree, and only offers the queries below. Tools walking the nodes
+    of a Quadtree, such as QueryWindow and TreeServer, do not accept it.
+    """
+    __slots__ = ("_root", "_next_id")
+
+    def __init__(self,
+                 bbox: Tuple[float, float, float, float],
+                 capacity: int = 10, max_depth=20):
+        self._root = _IdNode(bbox, TreeConfig(capacity, max_depth))
+        self._next_id = 0
+
+    @property
+    def bbox(self) -> Tuple[float, float, float, float]:
+        """Bounding box of the tree."""
+        return self._root.bbox
+
+    def insert(self, item: Optional[int], bbox: Tuple[float, float, float, float]) -> Optional[int]:
+        """Inserts an id into the tree.
+
+        :param item: Id to store, or None to let the tree assign the next free id
+        :param bbox: Bounding box of the item
+        :return: The id of the item, or None if bbox is outside the tree
+        """
+        if not Quadtree._rect_overlap(self._root.bbox, bbox):
+            return None
+        if item is None:
+            item = self._next_id
+        self._next_id = max(self._next_id, item + 1)
+        self._root._insert(item, tuple(map(float, bbox)), 0)
+        return item
+
+    def __iter__(self):
+        """Iterator over all ids of the tree, in increasing order."""
+        out = array('q')
+        self._root._collect_ids(out)
+        yield from numpy.unique(numpy.frombuffer(out, dtype=numpy.int64)).tolist()
+
+    def intersect(self, bbox):
+        """Creates a generator query of a rectangular region within the quadtree.
+
+        :param bbox: Intersection bounding box
+        :return: generator object yielding the ids in the region
+        """
+        yield from self.intersect_ids(bbox).tolist()
+
+    def intersect_ids(self, bbox) -> numpy.ndarray:
+        """Queries the ids of all items overlapping a rectangular region.
+
+        :param bbox: Intersection bounding box
+        :return: Sorted array of unique ids
+        """
+        out = array('q')
+        if Quadtree._rect_overlap(self._root.bbox, bbox):
+            self._root._query_ids(bbox, out)
+        # Items overlapping several children are stored once per child
+        return numpy.unique(numpy.frombuffer(out, dtype=numpy.int64))
+
+    def within(self, bbox):
+        """Creates a generator query of the ids lying entirely inside a rectangular region.
+
+        :param bbox: Query bounding box
+        :return: generator object yielding the ids inside the region
+        """
+        yield from self.within_ids(bbox).tolist()
+
+    def within_ids(self, bbox) -> numpy.ndarray:
+        """Queries the ids of all items lying entirely inside a rectangular region.
+
+        :param bbox: Query bounding box
+        :return: Sorted array of unique ids
+        """
+        out = array('q')
+        if Quadtree._rect_overlap(self._root.bbox, bbox):
+            self._root._query_within_ids(bbox, out)
+        return numpy.unique(numpy.frombuffer(out, dtype=numpy.int64))
+
+    def stab(self, point: Tuple[float, float]):
+        """Creates a generator query of the ids whose bounding box contains a point.
+
+        :param point: Query point
+        :return: generator object yielding the ids containing the point
+        """
+        yield from self.stab_ids(point).tolist()
+
+    def stab_ids(self, point: Tuple[float, float]) -> numpy.ndarray:
+        """Queries the ids of all items whose bounding box contains a point.
+
+        See `Quadtree.stab`.
+
+        :param point: Query point
+        :return: Sorted array of unique ids
+        """
+        out = array('q')
+        if Quadtree._is_point_inside(self._root.bbox, point):
+            self._root._query_path_ids(point, (*point, *point), out)
+        return numpy.unique(numpy.frombuffer(out, dtype=numpy.int64))
+
+    def enclosing(self, bbox):
+        """Creates a generator query of the ids whose bounding box contains a rectangular region.
+
+        :param bbox: Query bounding box
+        :return: generator object yielding the ids containing the region
+        """
+        yield from self.enclosing_ids(bbox).tolist()
+
+    def enclosing_ids(self, bbox) -> numpy.ndarray:
+        """Queries the ids of all items whose bounding box contains a rectangular region.
+
+        See `Quadtree.enclosing`.
+
+        :param bbox: Query bounding box
+        :return: Sorted array of unique ids
+        """
+        out = array('q')
+        if Quadtree._rect_overlap(self._root.bbox, bbox):
+            self._root._query_path_ids(bbox[:2], bbox, out)
+        return numpy.unique(numpy.frombuffer(out, dtype=numpy.int64))
+
+    def density(self, bbox, shape: Tuple[int, int]) -> numpy.ndarray:
+        """Counts the ids in each cell of a grid laid over a rectangular region.
+
+        Each id is counted once, in the cell containing the center of its bounding box,
+        see `Quadtree.density`. The entries of the nodes overlapping the region are
+        binned in one vectorized pass.
+
+        :param bbox: Region covered by the grid
+        :param shape: Number of cells as (rows, columns), rows along y
+        :return: numpy int64 array of the given shape with the id count of each cell
+        """
+        grid = numpy.zeros(shape, dtype=numpy.int64)
+        ids, boxes = array('q'), array('d')
+        if Quadtree._rect_overlap(self._root.bbox, bbox):
+            self._root._collect_entries(bbox, ids, boxes)
+        if not ids:
+            return grid
+        ids = numpy.frombuffer(ids, dtype=numpy.int64)
+        _, first = numpy.unique(ids, return_index=True)
+        boxes = numpy.frombuffer(boxes).reshape(-1, 4)[first]
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        q_low, q_high = numpy.asarray(bbox[:2], dtype=float), numpy.asarray(bbox[2:], dtype=float)
+        centers = centers[((centers >= q_low) & (centers <= q_high)).all(axis=1)]
+        # Grid axes are in reverse dimension order, like the rows and columns of an image
+        cells = numpy.array(shape[::-1])
+        size = (q_high - q_low) / cells
+        index = numpy.divide(centers - q_low, size, out=numpy.zeros_like(centers), where=size > 0)
+        index = numpy.minimum(index.astype(numpy.int64), cells - 1)
+        numpy.add.at(grid, (index[:, 1], index[:, 0]), 1)
+        return grid
+
+    def rebalance(self, capacity: Optional[int] = None):
+        """Rebuilds the tree from the ids currently stored in it.
+
+        See `Quadtree.rebalance`.
+
+        :param capacity: New capacity of each branch (default: keep the current capacity)
+        """
+        root = self._root
+        entries = {}
+        nodes = [root]
+        while nodes:
+            node = nodes.pop()
+            if node.children:
+                nodes.extend(node.children)
+            if node.ids is not None:
+                boxes = node.boxes
+                for i, item_id in enumerate(node.ids):
+                    entry = (item_id, tuple(boxes[4 * i:4 * i + 4]))
+                    entries[entry] = entry
+        if capacity is not None:
+            root._config.capacity = max(capacity, 1)
+        root.children = None
+        root.ids = None
+        root.boxes = None
+        for item_id, pt in entries:
+            root._insert(item_id, pt, 0)
+
+
+class _IdNode:
+    """Node of an IdQuadtree, splitting like a Quadtree node."""
+    __slots__ = ("_config", "bbox", "children", "ids", "boxes")
+
+    def __init__(self, bbox, config: TreeConfig):
+        self._config = config
+        self.bbox = bbox
+        self.children: Optional[List["_IdNode"]] = None
+        # Allocated when the first entry lands in this node
+        self.ids: Optional[array] = None
+        self.boxes: Optional[array] = None
+
+    center = Quadtree.center
+    _route = Quadtree._route
+
+    def _collect_ids(self, out: array):
+        if self.children:
+            for c in self.children:
+                c._collect_ids(out)
+        if self.ids is not None:
+            out.extend(self.ids)
+
+    def _collect_entries(self, bbox, ids: array, boxes: array):
+        """Appends the ids and boxes of all nodes overlapping bbox."""
+        if self.children:
+            for c in self.children:
+                if Quadtree._rect_overlap(c.bbox, bbox):
+                    c._collect_entries(bbox, ids, boxes)
+        if self.ids is not None:
+            ids.extend(self.ids)
+            boxes.extend(self.boxes)
+
+    def _query_ids(self, bbox, out: array):
+        # If the queried bounding box contains entire quad all ids can be copied without any checks
+        if Quadtree._rect_contains(bbox, self.bbox):
+            self._collect_ids(out)
+            return
+        if self.children:
+            if bbox[0] <= self.center[0]:
+                if bbox[1] <= self.center[1]:
+                    self.children[0]._query_ids(bbox, out)
+                if bbox[3] >= self.center[1]:
+                    self.children[1]._query_ids(bbox, out)
+            if bbox[2] >= self.center[0]:
+                if bbox[1] <= self.center[1]:
+                    self.children[2]._query_ids(bbox, out)
+                if bbox[3] >= self.center[1]:
+                    self.children[3]._query_ids(bbox, out)
+        if self.ids is None:
+            return
+        if len(self.ids) > self._config.capacity:
+            # Overflow buckets and leaves at max depth can be large, filter them vectorized
+            boxes = numpy.frombuffer(self.boxes).reshape(-1, 4)
+            hits = ((boxes[:, 0] <= bbox[2]) & (boxes[:, 1] <= bbox[3]) &
+                    (boxes[:, 2] >= bbox[0]) & (boxes[:, 3] >= bbox[1]))
+            out.frombytes(numpy.frombuffer(self.ids, dtype=numpy.int64)[hits].tobytes())
+        else:
+            boxes = self.boxes
+            for i, item_id in enumerate(self.ids):
+                j = 4 * i
+                if (boxes[j] <= bbox[2] and boxes[j + 1] <= bbox[3] and
+                        boxes[j + 2] >= bbox[0] and boxes[j + 3] >= bbox[1]):
+                    out.append(item_id)
+
+    def _query_within_ids(self, bbox, out: array):
+        if self.children:
+            if bbox[0] <= self.center[0]:
+                if bbox[1] <= self.center[1]:
+                    self.children[0]._query_within_ids(bbox, out)
+                if bbox[3] >= self.center[1]:
+                    self.children[1]._query_within_ids(bbox, out)
+            if bbox[2] >= self.center[0]:
+                if bbox[1] <= self.center[1]:
+                    self.children[2]._query_within_ids(bbox, out)
+                if bbox[3] >= self.center[1]:
+                    self.children[3]._query_within_ids(bbox, out)
+        inf = math.inf
+        self._filter_ids((bbox[0], bbox[1], -inf, -inf), (inf, inf, bbox[2], bbox[3]), out)
+
+    def _query_path_ids(self, point, bbox, out: array):
+        """Appends the ids containing bbox, following the child path of point."""
+        inf = math.inf
+        low, high = (-inf, -inf, bbox[2], bbox[3]), (bbox[0], bbox[1], inf, inf)
+        node = self
+        while node is not None:
+            node._filter_ids(low, high, out)
+            if not node.children:
+                return
+            node = node.children[(point[0] > node.center[0]) * 2 + (point[1] > node.center[1])]
+
+    def _filter_ids(self, low, high, out: array):
+        """Appends the ids of this node whose bounding box lies between low and high per coordinate."""
+        if self.ids is None:
+            return
+        boxes = numpy.frombuffer(self.boxes).reshape(-1, 4)
+        hits = ((boxes >= low) & (boxes <= high)).all(axis=1)
+        out.frombytes(numpy.frombuffer(self.ids, dtype=numpy.int64)[hits].tobytes())
+
+    def _insert(self, item_id: int, bbox: Tuple[float, float, float, float], depth: int):
+        if self.children:
+            self._insert_to_children(item_id, bbox, depth)
+        elif self.ids is None:
+            self.ids = array('q', (item_id,))
+            self.boxes = array('d', bbox)
+        else:
+            if (depth != self._config.max_depth and len(self.ids) >= self._config.capacity and
+                    not self._is_overflow(bbox)):
+                self._create_children()
+                ids, boxes = self.ids, self.boxes
+                self.ids = None
+                self.boxes = None
+                for i, entry_id in enumerate(ids):
+                    self._insert_to_children(entry_id, tuple(boxes[4 * i:4 * i + 4]), depth)
+                self._insert_to_children(item_id, bbox, depth)
+            else:
+                self.ids.append(item_id)
+                self.boxes.extend(bbox)
+
+    def _is_overflow(self, bbox: Tuple[float, float, float, float]):
+        """Checks if a split would fail to separate bbox from the ids of this leaf.
+
+        See `Quadtree._is_overflow`.
+        """
+        boxes = self.boxes
+        if len(self.ids) > self._config.capacity:
+            boxes = boxes[0:4]
+        route = self._route(bbox)
+        if route & 3 == 3 or route & 12 == 12:
+            return all(self._route(boxes[j:j + 4]) == route for j in range(0, len(boxes), 4))
+        return all(tuple(boxes[j:j + 4]) == bbox for j in range(0, len(boxes), 4))
+
+    def _insert_to_children(self, item_id: int, rect: Tuple[float, float, float, float], depth: int):
+        if (rect[0] <= self.center[0] <= rect[2] and rect[1] <= self.center[1] <= rect[3]):
+            if self.ids is None:
+                self.ids = array('q', (item_id,))
+                self.boxes = array('d', rect)
+            else:
+                self.ids.append(item_id)
+                self.boxes.extend(rect)
+        else:
+            depth += 1
+            if rect[0] <= self.center[0]:
+                if rect[1] <= self.center[1]:
+                    self.children[0]._insert(item_id, rect, depth)
+                if rect[3] >= self.center[1]:
+                    self.children[1]._insert(item_id, rect, depth)
+            if rect[2] >= self.center[0]:
+                if rect[1] <= self.center[1]:
+                    self.children[2]._insert(item_id, rect, depth)
+                if rect[3] >= self.center[1]:
+                    self.children[3]._insert(item_id, rect, depth)
+
+    def _create_children(self):
+        b = self.bbox
+        cx, cy = self.center
+        self.children = [
+            _IdNode((b[0], b[1], cx, cy), self._config),
+            _IdNode((b[0], cy, cx, b[3]), self._config),
+            _IdNode((cx, b[1], b[2], cy), self._config),
+            _IdNode((cx, cy, b[2], b[3]), self._config),
+        ]
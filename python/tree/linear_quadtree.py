@@ -0,0 +1,146 @@
+import numpy
+from typing import Tuple
+
+
+class LinearQuadtree:
+    """Pointer-free quadtree storing items sorted by the Z-order (Morton) key of their center.
+
+    Intended for static point data: inserts are buffered and the sorted key array is
+    rebuilt on the next query, so a query is answered by a few `searchsorted` range
+    scans over the key array instead of walking node objects. Items with an extent are
+    supported by widening queries with the largest half-extent of any stored item.
+    """
+
+    def __init__(self,
+                 bbox: Tuple[float, float, float, float],
+                 capacity: int = 10, max_depth=20):
+        self._capacity = capacity
+        self._bits = min(max_depth, 31)
+        self.bbox = bbox
+        self._keys = numpy.empty(0, dtype=numpy.uint64)
+        self._boxes = numpy.empty((0, 4))
+        self._items = []
+        self._extent = (0.0, 0.0)
+        self._pending_items = []
+        self._pending_boxes = []
+
+    @classmethod
+    def from_arrays(cls, bbox: Tuple[float, float, float, float], boxes, items=None,
+                    capacity: int = 10, max_depth=20):
+        """Builds the index from an (N, 4) array of bounding boxes in one vectorized pass.
+
+        :param bbox: Bounding box of the indexed region
+        :param boxes: Array of item bounding boxes, one row per item
+        :param items: Items connected to each row (default: the row index)
+        :return: LinearQuadtree holding all rows overlapping bbox
+        """
+        tree = cls(bbox, capacity, max_depth)
+        boxes = numpy.asarray(boxes, dtype=float).reshape(-1, 4)
+        if items is None:
+            items = range(len(boxes))
+        inside = ((boxes[:, 0] <= bbox[2]) & (boxes[:, 1] <= bbox[3]) &
+                  (boxes[:, 2] >= bbox[0]) & (boxes[:, 3] >= bbox[1]))
+        tree._pending_boxes = [boxes[inside]]
+        tree._pending_items = [item for item, keep in zip(items, inside.tolist()) if keep]
+        tree._flush()
+        return tree
+
+    def insert(self, item, bbox: Tuple[float, float, float, float]):
+        if not self._rect_overlap(self.bbox, bbox):
+            return False
+        self._pending_items.append(item)
+        self._pending_boxes.append(bbox)
+
+    def intersect(self, bbox):
+        """Creates a generator query of a rectangular region within the quadtree.
+
+        :param bbox: Intersection bounding box
+        :return: generator object corresponding to the query
+        """
+        self._flush()
+        if not self._items or not self._rect_overlap(self.bbox, bbox):
+            return
+        # Any item overlapping bbox has its center inside bbox widened by the largest half-extent
+        lo = self._cell(bbox[0] - self._extent[0], bbox[1] - self._extent[1])
+        hi = self._cell(bbox[2] + self._extent[0], bbox[3] + self._extent[1])
+        slices = []
+        self._collect_ranges(self._bits, 0, 0, 0, 0, len(self._keys), (*lo, *hi), slices)
+        if not slices:
+            return
+        idx = numpy.concatenate([numpy.arange(start, end) for start, end in slices])
+        boxes = self._boxes[idx]
+        hits = idx[(boxes[:, 0] <= bbox[2]) & (boxes[:, 1] <= bbox[3]) &
+                   (boxes[:, 2] >= bbox[0]) & (boxes[:, 3] >= bbox[1])]
+        items = self._items
+        for i in hits.tolist():
+            yield items[i]
+
+    def _collect_ranges(self, shift, cx, cy, key, start, end, cells, slices):
+        # The block at (cx, cy) covers 2**shift cells along each axis and the
+        # contiguous key range starting at key. start:end are its item indices.
+        x0, y0 = cx << shift, cy << shift
+        x1, y1 = x0 + (1 << shift) - 1, y0 + (1 << shift) - 1
+        if x0 > cells[2] or y0 > cells[3] or x1 < cells[0] or y1 < cells[1]:
+            return
+        if (shift == 0 or end - start <= self._capacity or
+                (cells[0] <= x0 and cells[1] <= y0 and x1 <= cells[2] and y1 <= cells[3])):
+            slices.append((start, end))
+            return
+        shift -= 1
+        size = 1 << (2 * shift)
+        bounds = self._keys[start:end].searchsorted(
+            numpy.array([key + q * size for q in range(1, 4)], dtype=numpy.uint64)) + start
+        bounds = [start, *bounds.tolist(), end]
+        for q in range(4):
+            if bounds[q] != bounds[q + 1]:
+                self._collect_ranges(shift, cx * 2 + (q & 1), cy * 2 + (q >> 1), key + q * size,
+                                     bounds[q], bounds[q + 1], cells, slices)
+
+    def _flush(self):
+        """Merges buffered inserts into the sorted key array."""
+        if not self._pending_items:
+            return
+        pending = numpy.asarray(self._pending_boxes, dtype=float).reshape(-1, 4)
+        boxes = numpy.concatenate([self._boxes, pending])
+        items = self._items + self._pending_items
+        self._pending_items = []
+        self._pending_boxes = []
+        x = (boxes[:, 0] + boxes[:, 2]) / 2
+        y = (boxes[:, 1] + boxes[:, 3]) / 2
+        cx, cy = self._cell(x, y)
+        keys = self._interleave(cx) | (self._interleave(cy) << numpy.uint64(1))
+        order = numpy.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._boxes = boxes[order]
+        self._items = [items[i] for i in order.tolist()]
+        self._extent = (float((boxes[:, 2] - boxes[:, 0]).max()) / 2,
+                        float((boxes[:, 3] - boxes[:, 1]).max()) / 2)
+
+    def _cell(self, x, y):
+        """Quantizes coordinates to cell indices, clamped to the tree region."""
+        cells = 1 << self._bits
+        width = self.bbox[2] - self.bbox[0]
+        height = self.bbox[3] - self.bbox[1]
+        cx = numpy.clip(numpy.floor((numpy.asarray(x) - self.bbox[0]) / width * cells), 0, cells - 1)
+        cy = numpy.clip(numpy.floor((numpy.asarray(y) - self.bbox[1]) / height * cells), 0, cells - 1)
+        if cx.ndim == 0:
+            return int(cx), int(cy)
+        return cx.astype(numpy.uint64), cy.astype(numpy.uint64)
+
+    @staticmethod
+    def _interleave(v):
+        """Spreads the lower 32 bits of each value to the even bit positions."""
+        v = v & numpy.uint64(0x00000000FFFFFFFF)
+        v = (v | (v << numpy.uint64(16))) & numpy.uint64(0x0000FFFF0000FFFF)
+        v = (v | (v << numpy.uint64(8))) & numpy.uint64(0x00FF00FF00FF00FF)
+        v = (v | (v << numpy.uint64(4))) & numpy.uint64(0x0F0F0F0F0F0F0F0F)
+        v = (v | (v << numpy.uint64(2))) & numpy.uint64(0x3333333333333333)
+        v = (v | (v << numpy.uint64(1))) & numpy.uint64(0x5555555555555555)
+        return v
+
+    @staticmethod
+    def _rect_overlap(bbox1, bbox2):
+        return (bbox1[0] <= bbox2[2] and
+                bbox1[1] <= bbox2[3] and
+                bbox1[2] >= bbox2[0] and
+                bbox1[3] >= bbox2[1])
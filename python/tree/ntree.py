@@ -1,79 +1,240 @@
 import numpy
 from typing import Tuple, Optional, List
 
+from .config import TreeConfig
+from .density import count_insert, density
+
 
 class NTree:
+    # The depth of a node is derived from its path from the root
+    __slots__ = ("_config", "bbox", "center", "children", "points", "mask", "count")
+
     def __init__(self, bbox: Tuple[float, ...], capacity: int = 10, max_depth: int = 20):
-        self._capacity = capacity
-        self._max_depth = max_depth
-        self.bbox = numpy.array(bbox)
-        self.bbox = self.bbox.reshape(2, self.bbox.size // 2)
+        bbox = numpy.array(bbox)
+        self._init_node(bbox.reshape(2, bbox.size // 2), TreeConfig(capacity, max_depth))
+
+    @property
+    def _child_bits(self):
+        # Bit of the child index set for the children on the high side of each dimension
+        return 2 ** numpy.arange(self.bbox.shape[1])
+
+    def _init_node(self, bbox, config: TreeConfig):
+        self._config = config
+        self.bbox = bbox
         self.center = self.bbox.sum(axis=0) / 2
         self.children: Optional[List["NTree"]] = None
-        self.points = []
-        self.depth = 0
+        # Allocated when the first entry lands in this node
+        self.points: Optional[list] = None
+        # Bitwise OR of the masks of all entries in this subtree
+        self.mask = 0
+        # Number of items centered in this subtree, None until computed by density
+        self.count = None
 
-    def insert(self, data, bbox):
+    def insert(self, data, bbox, mask: int = -1):
         bbox = numpy.array(bbox).reshape(self.bbox.shape)
         if not self._rect_overlap(self.bbox, bbox):
             return False
-        self._insert(data, bbox)
+        self._insert(data, bbox, mask, 0)
+        if self.count is not None and mask:
+            # Counts are only kept up to date once density has computed them, and leave
+            # out items without categories, which no query returns
+            count_insert(self, bbox)
+
+    def intersect(self, bbox: Tuple[float, ...], mask: int = -1):
+        bbox = numpy.array(bbox).reshape(self.bbox.shape)
+        yield from self._query_rect(bbox, set(), mask)
+
+    def within(self, bbox: Tuple[float, ...], mask: int = -1):
+        """Creates a generator query of the items lying entirely inside a box.
+
+        Args:
+            bbox: Query bounding box
+            mask: Only yield items whose mask shares a bit with this mask (default: all items)
+        """
+        bbox = numpy.array(bbox).reshape(self.bbox.shape)
+        if self._rect_overlap(self.bbox, bbox):
+            yield from self._query_within(bbox, set(), mask)
 
-    def intersect(self, bbox: Tuple[float, ...]):
+    def stab(self, point: Tuple[float, ...], mask: int = -1):
+        """Creates a generator query of the items whose bounding box contains a point.
+
+        An item containing the point is stored on the side of each split the point
+        falls on, so only a single child is visited per level.
+
+        Args:
+            point: Query point
+            mask: Only yield items whose mask shares a bit with this mask (default: all items)
+        """
+        point = numpy.array(point, dtype=float)
+        bbox = numpy.array([point, point])
+        if self._rect_contains(self.bbox, bbox):
+            yield from self._query_path(point, bbox, mask)
+
+    def enclosing(self, bbox: Tuple[float, ...], mask: int = -1):
+        """Creates a generator query of the items whose bounding box contains a box.
+
+        Only the nodes on the path of the box's lower corner are visited.
+
+        Args:
+            bbox: Query bounding box
+            mask: Only yield items whose mask shares a bit with this mask (default: all items)
+        """
         bbox = numpy.array(bbox).reshape(self.bbox.shape)
-        yield from self._query_rect(bbox, set())
+        if self._rect_overlap(self.bbox, bbox):
+            yield from self._query_path(bbox[0], bbox, mask)
+
+    def density(self, bbox: Tuple[float, ...], shape: Tuple[int, ...], mask: int = -1) -> numpy.ndarray:
+        """Counts the items in each cell of a grid laid over a box.
+
+        Each item is counted once, in the cell containing the center of its bounding box.
+        Nodes lying within a single cell add their item count without visiting their items.
+
+        Args:
+            bbox: Region covered by the grid
+            shape: Number of cells along each dimension, last dimension first
+            mask: Only count items whose mask shares a bit with this mask (default: all items)
+        Returns:
+            Array of the given shape with the item count of each cell
+        """
+        return density(self, bbox, shape, mask)
+
+    def rebalance(self, capacity: Optional[int] = None):
+        """Rebuilds the tree from the items currently stored in it.
+
+        Nodes left empty by earlier splits are dropped. Entries no split can separate
+        are kept in overflow buckets regardless of the capacity.
+
+        Args:
+            capacity: New capacity of each branch (default: keep the current capacity)
+        """
+        entries = {}
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            if node.children:
+                nodes.extend(node.children)
+            for obj, obj_bbox, obj_mask in node.points or ():
+                entries[(id(obj), id(obj_bbox))] = (obj, obj_bbox, obj_mask)
+        if capacity is not None:
+            self._config.capacity = max(capacity, 1)
+        self.children = None
+        self.points = None
+        self.mask = 0
+        self.count = None
+        for obj, obj_bbox, obj_mask in entries.values():
+            self._insert(obj, obj_bbox, obj_mask, 0)
 
     def __iter__(self):
-        self._iter(set())
+        return self._iter(set(), -1)
 
-    def _iter(self, uniq: set):
+    def _iter(self, uniq: set, mask: int):
+        if not self.mask & mask:
+            return
         if self.children:
             for c in self.children:
-                yield from c._iter(uniq)
-        for obj, _ in self.points:
+                yield from c._iter(uniq, mask)
+        for obj, _, obj_mask in self.points or ():
             obj_id = id(obj)
-            if obj_id not in uniq:
+            if obj_id not in uniq and obj_mask & mask:
                 uniq.add(obj_id)
                 yield obj
 
-    def _query_rect(self, bbox, uniq: set):
+    def _query_rect(self, bbox, uniq: set, mask: int):
+        if not self.mask & mask:
+            # No entry in this subtree belongs to the queried categories
+            return
         # If the queried bounding box contains entire quad we can start iterating without any checks
         # all items should in this case match
         if self._rect_contains(bbox, self.bbox):
-            yield from self._iter(uniq)
+            yield from self._iter(uniq, mask)
         else:
             if self.children:
                 for child in self.children:
                     if child._rect_overlap(child.bbox, bbox):
-                        yield from child._query_rect(bbox, uniq)
-            for obj, obj_bbox in self.points:
+                        yield from child._query_rect(bbox, uniq, mask)
+            for obj, obj_bbox, obj_mask in self.points or ():
                 obj_id = id(obj)
-                if obj_id not in uniq and self._rect_overlap(bbox, obj_bbox):
+                if obj_id not in uniq and obj_mask & mask and self._rect_overlap(bbox, obj_bbox):
                     uniq.add(obj_id)
                     yield obj
 
-    def _insert(self, data, bbox: Tuple[float, float, float, float]):
+    def _query_within(self, bbox, uniq: set, mask: int):
+        if not self.mask & mask:
+            return
         if self.children:
-            self._insert_to_children(data, bbox)
+            for child in self.children:
+                if child._rect_overlap(child.bbox, bbox):
+                    yield from child._query_within(bbox, uniq, mask)
+        for obj, obj_bbox, obj_mask in self.points or ():
+            obj_id = id(obj)
+            if obj_id not in uniq and obj_mask & mask and self._rect_contains(bbox, obj_bbox):
+                uniq.add(obj_id)
+                yield obj
+
+    def _query_path(self, point, bbox, mask: int):
+        """Yields the items containing bbox, following the child path of point."""
+        polarity = 2 ** numpy.arange(self.bbox.shape[1])
+        uniq = set()
+        node = self
+        while node is not None and node.mask & mask:
+            for obj, obj_bbox, obj_mask in node.points or ():
+                obj_id = id(obj)
+                if obj_id not in uniq and obj_mask & mask and self._rect_contains(obj_bbox, bbox):
+                    uniq.add(obj_id)
+                    yield obj
+            if not node.children:
+                return
+            # Entries are routed by overlap with the child boxes, so split on their shared corner
+            split = node.children[-1].bbox[0]
+            node = node.children[int(polarity[point > split].sum())]
+
+    def _insert(self, data, bbox, mask: int, depth: int):
+        self.mask |= mask
+        if self.children:
+            self._insert_to_children(data, bbox, mask, depth)
+        elif self.points is None:
+            self.points = [(data, bbox, mask)]
         else:
-            if self.depth != self._max_depth and len(self.points) == self._capacity:
+            if (depth != self._config.max_depth and len(self.points) >= self._config.capacity and
+                    not self._is_overflow(bbox)):
                 self._create_children()
                 points = self.points
-                self.points = []
-                for i, p in points:
-                    self._insert_to_children(i, p)
-                self._insert_to_children(data, bbox)
+                self.points = None
+                for i, p, m in points:
+                    self._insert_to_children(i, p, m, depth)
+                self._insert_to_children(data, bbox, mask, depth)
             else:
-                self.points.append((data, bbox))
+                self.points.append((data, bbox, mask))
+
+    def _is_overflow(self, bbox):
+        # When every entry reaches the same sides of all split planes, and both sides of
+        # at least one, each child would receive either all of the entries or none. Entries
+        # reaching a single child are only never separated if their bounding boxes are
+        # equal. A leaf only grows past its capacity while this holds, so such an overflow
+        # bucket is checked against its first item.
+        points = self.points
+        if len(points) > self._config.capacity:
+            points = points[:1]
+        route = self._route(bbox)
+        if (route[0] & route[1]).any():
+            return all(numpy.array_equal(self._route(obj_bbox), route) for _, obj_bbox, _ in points)
+        return all(numpy.array_equal(obj_bbox, bbox) for _, obj_bbox, _ in points)
 
-    def _insert_to_children(self, data, bbox):
+    def _route(self, bbox):
+        """Sides of the split planes reached by bbox, as rows for the low and high sides."""
+        return numpy.array([bbox[0] <= self.center, bbox[1] >= self.center])
+
+    def _insert_to_children(self, data, bbox, mask: int, depth: int):
         if all(bbox[0] <= self.center) and all(self.center <= bbox[1]):
             # Point overlap with all children
-            self.points.append((data, bbox))
+            if self.points is None:
+                self.points = [(data, bbox, mask)]
+            else:
+                self.points.append((data, bbox, mask))
         else:
             for child in self.children:
                 if child._rect_overlap(child.bbox, bbox):
-                    child._insert(data, bbox)
+                    child._insert(data, bbox, mask, depth + 1)
 
     @staticmethod
     def _rect_overlap(bbox1, bbox2):
@@ -97,6 +258,6 @@ class NTree:
             mult = (i // polarity % 2)
             top_left = self.bbox[0]+mult*size2
             bbox = numpy.array([top_left, top_left + size2])
-            child = NTree(bbox, capacity=self._capacity, max_depth=self._max_depth)
-            child.depth = self.depth + 1
+            child = type(self).__new__(type(self))
+            child._init_node(bbox, self._config)
             self.children.append(child)
@@ -1,157 +1,399 @@
 from typing import Tuple, Optional, List
 
+from .config import TreeConfig
+from .density import count_insert, density
+from .parallel import build_parallel
+
 
 class Octree:
+    # The center and depth of a node are derived from its bbox and its path from the root
+    __slots__ = ("_config", "bbox", "children", "points", "mask", "count", "content")
+    # Bit of the child index set for the children on the high side of each dimension
+    _child_bits = (4, 2, 1)
+
     def __init__(self,
                  bbox: Tuple[float, float, float, float, float, float],
                  capacity: int = 10, max_depth=20):
-        self._capacity = capacity
+        self._init_node(bbox, TreeConfig(capacity, max_depth))
+
+    def _init_node(self, bbox, config: TreeConfig):
+        self._config = config
         self.bbox = bbox
-        self.center = ((bbox[3] - bbox[0]) / 2 + bbox[0],
-                       (bbox[4] - bbox[1]) / 2 + bbox[1],
-                       (bbox[5] - bbox[2]) / 2 + bbox[2])
-        self.parent = None
         self.children: Optional[List["Octree"]] = None
-        self.points = []
-        self.depth = 0
-        self._max_depth = max_depth
+        # Allocated when the first entry lands in this node
+        self.points: Optional[list] = None
+        # Bitwise OR of the masks of all entries in this subtree
+        self.mask = 0
+        # Number of items centered in this subtree, None until computed by density
+        self.count = None
+        # Union of the parts of the entries of this subtree lying inside bbox, only kept
+        # once the node has children, leaves check their few entries one by one
+        self.content = None
+
+    @property
+    def center(self) -> Tuple[float, float, float]:
+        """Point where the node splits into its children."""
+        b = self.bbox
+        return (b[3] - b[0]) / 2 + b[0], (b[4] - b[1]) / 2 + b[1], (b[5] - b[2]) / 2 + b[2]
 
-    def insert(self, item, bbox: Tuple[float, float, float, float, float, float]):
+    @classmethod
+    def build_parallel(cls, bbox: Tuple[float, float, float, float, float, float], bboxes, items=None,
+                       capacity: int = 10, max_depth=20, workers: Optional[int] = None, masks=None):
+        """Builds a tree from many bounding boxes, constructing subtrees in separate processes.
+
+        The result is identical to inserting the items one by one in the given order.
+
+        :param bbox: Tree bounding box
+        :param bboxes: Bounding boxes of the items, one row per item
+        :param items: Items connected to each bounding box (default: the row index)
+        :param capacity: Capacity of each branch (default: 10)
+        :param max_depth: Maximum depth until tree stops splitting into new regions
+        :param workers: Number of worker processes (default: number of CPUs)
+        :param masks: Category bits of each item (default: all categories)
+        :return: The built tree
+        """
+        return build_parallel(cls, bbox, bboxes, items, capacity, max_depth, workers, masks=masks)
+
+    def insert(self, item, bbox: Tuple[float, float, float, float, float, float], mask: int = -1):
         if not self._rect_overlap(self.bbox, bbox):
             return False
-        self._insert(item, bbox)
+        self._insert(item, bbox, mask, 0)
+        if self.count is not None and mask:
+            # Counts are only kept up to date once density has computed them, and leave
+            # out items without categories, which no query returns
+            count_insert(self, bbox)
 
-    def intersect(self, bbox):
+    def intersect(self, bbox, mask: int = -1):
         """Creates a generator query of a rectangular region within the quadtree.
 
         :param bbox: Intersection bounding box
+        :param mask: Only yield items whose mask shares a bit with this mask (default: all items)
+        :return: generator object corresponding to the query
+        """
+        if self._rect_overlap(self.bbox, bbox):
+            yield from self._query_rect(bbox, set(), mask)
+
+    def within(self, bbox, mask: int = -1):
+        """Creates a generator query of the items lying entirely inside a box.
+
+        :param bbox: Query bounding box
+        :param mask: Only yield items whose mask shares a bit with this mask (default: all items)
         :return: generator object corresponding to the query
         """
         if self._rect_overlap(self.bbox, bbox):
-            yield from self._query_rect(bbox, set())
+            yield from self._query_within(bbox, set(), mask)
+
+    def stab(self, point: Tuple[float, float, float], mask: int = -1):
+        """Creates a generator query of the items whose bounding box contains a point.
+
+        An item containing the point is stored on the side of each split the point
+        falls on, so only a single child is visited per level.
+
+        :param point: Query point
+        :param mask: Only yield items whose mask shares a bit with this mask (default: all items)
+        :return: generator object corresponding to the query
+        """
+        if self._is_point_inside(self.bbox, point):
+            yield from self._query_path(point, (*point, *point), mask)
+
+    def enclosing(self, bbox, mask: int = -1):
+        """Creates a generator query of the items whose bounding box contains a box.
+
+        Only the nodes on the path of the box's lower corner are visited.
+
+        :param bbox: Query bounding box
+        :param mask: Only yield items whose mask shares a bit with this mask (default: all items)
+        :return: generator object corresponding to the query
+        """
+        if self._rect_overlap(self.bbox, bbox):
+            yield from self._query_path(bbox[:3], bbox, mask)
+
+    def density(self, bbox, shape: Tuple[int, int, int], mask: int = -1):
+        """Counts the items in each cell of a grid laid over a box.
+
+        Each item is counted once, in the cell containing the center of its bounding box.
+        Nodes lying within a single cell add their item count without visiting their items.
+
+        :param bbox: Region covered by the grid
+        :param shape: Number of cells along z, y and x
+        :param mask: Only count items whose mask shares a bit with this mask (default: all items)
+        :return: numpy int64 array of the given shape with the item count of each cell
+        """
+        return density(self, bbox, shape, mask)
+
+    def rebalance(self, capacity: Optional[int] = None):
+        """Rebuilds the tree from the items currently stored in it.
+
+        Nodes left empty by earlier splits are dropped. Entries no split can separate
+        are kept in overflow buckets regardless of the capacity, so duplicate-heavy data
+        does not call for a larger capacity.
+
+        :param capacity: New capacity of each branch (default: keep the current capacity)
+        """
+        entries = {}
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            if node.children:
+                nodes.extend(node.children)
+            for obj, pt, obj_mask in node.points or ():
+                entries[(id(obj), id(pt))] = (obj, pt, obj_mask)
+        if capacity is not None:
+            self._config.capacity = max(capacity, 1)
+        self.children = None
+        self.points = None
+        self.mask = 0
+        self.count = None
+        self.content = None
+        for obj, pt, obj_mask in entries.values():
+            self._insert(obj, pt, obj_mask, 0)
 
     def __iter__(self):
         """Iterator to return all objects in this Quadtree node or all children."""
-        self._iter(set())
+        return self._iter(set(), -1)
 
-    def _iter(self, uniq: set):
+    def _iter(self, uniq: set, mask: int):
+        if not self.mask & mask:
+            return
         if self.children:
             for c in self.children:
-                yield from c._iter(uniq)
-            for obj, _ in self.points:
+                yield from c._iter(uniq, mask)
+            for obj, _, obj_mask in self.points or ():
                 obj_id = id(obj)
-                if obj_id not in uniq:
+                if obj_id not in uniq and obj_mask & mask:
                     uniq.add(obj_id)
                     yield obj
         else:
-            for obj, _ in self.points:
+            for obj, _, obj_mask in self.points or ():
                 obj_id = id(obj)
-                if obj_id not in uniq:
+                if obj_id not in uniq and obj_mask & mask:
                     uniq.add(obj_id)
                     yield obj
 
-    def _query_rect(self, bbox, uniq: set):
-        # If the queried bounding box contains entire quad we can start iterating without any checks
-        # all items should in this case match
-        if self._rect_contains(bbox, self.bbox):
-            yield from self._iter(uniq)
+    def _query_rect(self, bbox, uniq: set, mask: int):
+        if not self.mask & mask:
+            # No entry in this subtree belongs to the queried categories
+            return
+        content = self.content or self.bbox
+        if not self._rect_overlap(content, bbox):
+            # The entries of this subtree are clustered away from the queried region
+            return
+        # If the queried bounding box contains the content of the node we can start iterating
+        # without any checks, all items should in this case match
+        if self._rect_contains(bbox, content):
+            yield from self._iter(uniq, mask)
         else:
             if self.children:
-                if bbox[0] <= self.center[0]:
-                    if bbox[1] <= self.center[1]:
-                        if bbox[2] <= self.center[2]:
-                            yield from self.children[0]._query_rect(bbox, uniq)
-                        if bbox[5] >= self.center[2]:
-                            yield from self.children[1]._query_rect(bbox, uniq)
-                    if bbox[4] >= self.center[1]:
-                        if bbox[2] <= self.center[2]:
-                            yield from self.children[2]._query_rect(bbox, uniq)
-                        if bbox[5] >= self.center[2]:
-                            yield from self.children[3]._query_rect(bbox, uniq)
-                if bbox[3] >= self.center[0]:
-                    if bbox[1] <= self.center[1]:
-                        if bbox[2] <= self.center[2]:
-                            yield from self.children[4]._query_rect(bbox, uniq)
-                        if bbox[5] >= self.center[2]:
-                            yield from self.children[5]._query_rect(bbox, uniq)
-                    if bbox[4] >= self.center[1]:
-                        if bbox[2] <= self.center[2]:
-                            yield from self.children[6]._query_rect(bbox, uniq)
-                        if bbox[5] >= self.center[2]:
-                            yield from self.children[7]._query_rect(bbox, uniq)
-            for obj, pt in self.points:
+                cx, cy, cz = self.center
+                if bbox[0] <= cx:
+                    if bbox[1] <= cy:
+                        if bbox[2] <= cz:
+                            yield from self.children[0]._query_rect(bbox, uniq, mask)
+                        if bbox[5] >= cz:
+                            yield from self.children[1]._query_rect(bbox, uniq, mask)
+                    if bbox[4] >= cy:
+                        if bbox[2] <= cz:
+                            yield from self.children[2]._query_rect(bbox, uniq, mask)
+                        if bbox[5] >= cz:
+                            yield from self.children[3]._query_rect(bbox, uniq, mask)
+                if bbox[3] >= cx:
+                    if bbox[1] <= cy:
+                        if bbox[2] <= cz:
+                            yield from self.children[4]._query_rect(bbox, uniq, mask)
+                        if bbox[5] >= cz:
+                            yield from self.children[5]._query_rect(bbox, uniq, mask)
+                    if bbox[4] >= cy:
+                        if bbox[2] <= cz:
+                            yield from self.children[6]._query_rect(bbox, uniq, mask)
+                        if bbox[5] >= cz:
+                            yield from self.children[7]._query_rect(bbox, uniq, mask)
+            for obj, pt, obj_mask in self.points or ():
                 obj_id = id(obj)
-                if obj_id not in uniq and self._rect_overlap(bbox, pt):
+                if obj_id not in uniq and obj_mask & mask and self._rect_overlap(bbox, pt):
                     uniq.add(obj_id)
                     yield obj
 
-    def _insert(self, item, bbox: Tuple[float, float, float, float]):
+    def _query_within(self, bbox, uniq: set, mask: int):
+        if not self.mask & mask or not self._rect_overlap(self.content or self.bbox, bbox):
+            return
         if self.children:
-            self._insert_to_children(item, bbox)
+            cx, cy, cz = self.center
+            if bbox[0] <= cx:
+                if bbox[1] <= cy:
+                    if bbox[2] <= cz:
+                        yield from self.children[0]._query_within(bbox, uniq, mask)
+                    if bbox[5] >= cz:
+                        yield from self.children[1]._query_within(bbox, uniq, mask)
+                if bbox[4] >= cy:
+                    if bbox[2] <= cz:
+                        yield from self.children[2]._query_within(bbox, uniq, mask)
+                    if bbox[5] >= cz:
+                        yield from self.children[3]._query_within(bbox, uniq, mask)
+            if bbox[3] >= cx:
+                if bbox[1] <= cy:
+                    if bbox[2] <= cz:
+                        yield from self.children[4]._query_within(bbox, uniq, mask)
+                    if bbox[5] >= cz:
+                        yield from self.children[5]._query_within(bbox, uniq, mask)
+                if bbox[4] >= cy:
+                    if bbox[2] <= cz:
+                        yield from self.children[6]._query_within(bbox, uniq, mask)
+                    if bbox[5] >= cz:
+                        yield from self.children[7]._query_within(bbox, uniq, mask)
+        for obj, pt, obj_mask in self.points or ():
+            obj_id = id(obj)
+            if obj_id not in uniq and obj_mask & mask and self._rect_contains(bbox, pt):
+                uniq.add(obj_id)
+                yield obj
+
+    def _query_path(self, point, bbox, mask: int):
+        """Yields the items containing bbox, following the child path of point."""
+        uniq = set()
+        node = self
+        while node is not None and node.mask & mask:
+            for obj, pt, obj_mask in node.points or ():
+                obj_id = id(obj)
+                if obj_id not in uniq and obj_mask & mask and self._rect_contains(pt, bbox):
+                    uniq.add(obj_id)
+                    yield obj
+            if not node.children:
+                return
+            cx, cy, cz = node.center
+            node = node.children[(point[0] > cx) * 4 + (point[1] > cy) * 2 + (point[2] > cz)]
+
+    def _insert(self, item, bbox: Tuple[float, float, float, float, float, float], mask: int, depth: int):
+        x0, y0, z0, x1, y1, z1 = bbox
+        node = self
+        while node.children:
+            node.mask |= mask
+            c0, c1, c2, c3, c4, c5 = node.content
+            if x0 < c0 or y0 < c1 or z0 < c2 or x1 > c3 or y1 > c4 or z1 > c5:
+                node._grow_content(bbox)
+            b0, b1, b2, b3, b4, b5 = node.bbox
+            cx = (b3 - b0) / 2 + b0
+            cy = (b4 - b1) / 2 + b1
+            cz = (b5 - b2) / 2 + b2
+            if (x0 <= cx <= x1) or (y0 <= cy <= y1) or (z0 <= cz <= z1):
+                node._insert_to_children(item, bbox, mask, depth)
+                return
+            # Descend without a call while bbox reaches a single child
+            node = node.children[(x1 >= cx) * 4 + (y1 >= cy) * 2 + (z1 >= cz)]
+            depth += 1
+        node.mask |= mask
+        if node.points is None:
+            node.points = [(item, bbox, mask)]
+        elif (depth != node._config.max_depth and len(node.points) >= node._config.capacity and
+              not node._is_overflow(bbox)):
+            node._create_children()
+            points = node.points
+            node.points = None
+            for i, p, m in points:
+                node._grow_content(p)
+                node._insert_to_children(i, p, m, depth)
+            node._grow_content(bbox)
+            node._insert_to_children(item, bbox, mask, depth)
         else:
-            if self.depth != self._max_depth and len(self.points) == self._capacity:
-                self._create_children()
-                points = self.points
-                self.points = []
-                for i, p in points:
-                    self._insert_to_children(i, p)
-                self._insert_to_children(item, bbox)
-            else:
-                self.points.append((item,bbox))
+            node.points.append((item, bbox, mask))
 
-    def _insert_to_children(self, item, rect: Tuple[float, float, float, float]):
+    def _grow_content(self, rect: Tuple[float, float, float, float, float, float]):
+        """Extends the content bounds by the part of rect lying inside this node."""
+        c = self.content
+        b = self.bbox
+        if c is None:
+            self.content = (max(rect[0], b[0]), max(rect[1], b[1]), max(rect[2], b[2]),
+                            min(rect[3], b[3]), min(rect[4], b[4]), min(rect[5], b[5]))
+        else:
+            self.content = (max(min(rect[0], c[0]), b[0]), max(min(rect[1], c[1]), b[1]),
+                            max(min(rect[2], c[2]), b[2]), min(max(rect[3], c[3]), b[3]),
+                            min(max(rect[4], c[4]), b[4]), min(max(rect[5], c[5]), b[5]))
+
+    def _update_content(self):
+        """Recomputes the content bounds from the entries and children of this node."""
+        self.content = None
+        if not self.children:
+            return
+        for _, pt, _ in self.points or ():
+            self._grow_content(pt)
+        for child in self.children:
+            if child.content is not None:
+                self._grow_content(child.content)
+            elif not child.children:
+                for _, pt, _ in child.points or ():
+                    self._grow_content(pt)
+
+    def _is_overflow(self, bbox: Tuple[float, float, float, float, float, float]):
+        """Checks if a split would fail to separate bbox from the items of this leaf.
+
+        See `Quadtree._is_overflow`.
+        """
+        points = self.points
+        if len(points) > self._config.capacity:
+            points = points[:1]
+        route = self._route(bbox)
+        if route & 3 == 3 or route & 12 == 12 or route & 48 == 48:
+            return all(self._route(pt) == route for _, pt, _ in points)
+        return all(self._rect_equal(pt, bbox) for _, pt, _ in points)
+
+    def _route(self, rect: Tuple[float, float, float, float, float, float]) -> int:
+        """Bit set of the sides of the split planes reached by rect, low side first per dimension."""
+        cx, cy, cz = self.center
+        return ((rect[0] <= cx) | (rect[3] >= cx) << 1 | (rect[1] <= cy) << 2 | (rect[4] >= cy) << 3 |
+                (rect[2] <= cz) << 4 | (rect[5] >= cz) << 5)
+
+    def _insert_to_children(self, item, rect: Tuple[float, float, float, float], mask: int, depth: int):
+        cx, cy, cz = self.center
         if (
-                rect[0] <= self.center[0] <= rect[3] and
-                rect[1] <= self.center[1] <= rect[4] and
-                rect[2] <= self.center[2] <= rect[5]
+                rect[0] <= cx <= rect[3] and
+                rect[1] <= cy <= rect[4] and
+                rect[2] <= cz <= rect[5]
         ):
-            self.points.append((item, rect))
+            if self.points is None:
+                self.points = [(item, rect, mask)]
+            else:
+                self.points.append((item, rect, mask))
         else:
-            if rect[0] <= self.center[0]:
-                if rect[1] <= self.center[1]:
-                    if rect[2] <= self.center[2]:
-                        self.children[0]._insert(item, rect)
-                    if rect[5] >= self.center[2]:
-                        self.children[1]._insert(item, rect)
-                if rect[4] >= self.center[1]:
-                    if rect[2] <= self.center[2]:
-                        self.children[2]._insert(item, rect)
-                    if rect[5] >= self.center[2]:
-                        self.children[3]._insert(item, rect)
-            if rect[3] >= self.center[0]:
-                if rect[1] <= self.center[1]:
-                    if rect[2] <= self.center[2]:
-                        self.children[4]._insert(item, rect)
-                    if rect[5] >= self.center[2]:
-                        self.children[5]._insert(item, rect)
-                if rect[4] >= self.center[1]:
-                    if rect[2] <= self.center[2]:
-                        self.children[6]._insert(item, rect)
-                    if rect[5] >= self.center[2]:
-                        self.children[7]._insert(item, rect)
+            depth += 1
+            if rect[0] <= cx:
+                if rect[1] <= cy:
+                    if rect[2] <= cz:
+                        self.children[0]._insert(item, rect, mask, depth)
+                    if rect[5] >= cz:
+                        self.children[1]._insert(item, rect, mask, depth)
+                if rect[4] >= cy:
+                    if rect[2] <= cz:
+                        self.children[2]._insert(item, rect, mask, depth)
+                    if rect[5] >= cz:
+                        self.children[3]._insert(item, rect, mask, depth)
+            if rect[3] >= cx:
+                if rect[1] <= cy:
+                    if rect[2] <= cz:
+                        self.children[4]._insert(item, rect, mask, depth)
+                    if rect[5] >= cz:
+                        self.children[5]._insert(item, rect, mask, depth)
+                if rect[4] >= cy:
+                    if rect[2] <= cz:
+                        self.children[6]._insert(item, rect, mask, depth)
+                    if rect[5] >= cz:
+                        self.children[7]._insert(item, rect, mask, depth)
 
     def _create_children(self):
+        b = self.bbox
+        cx, cy, cz = self.center
         self.children = [
-            Octree((self.bbox[0],   self.bbox[1],   self.bbox[2],
-                    self.center[0], self.center[1], self.center[2]), self._capacity, self._max_depth),
-            Octree((self.bbox[0],   self.bbox[1],   self.center[2],
-                    self.center[0], self.center[1], self.bbox[5]), self._capacity, self._max_depth),
-            Octree((self.bbox[0],   self.center[1], self.bbox[2],
-                    self.center[0], self.bbox[4],   self.center[2]), self._capacity, self._max_depth),
-            Octree((self.bbox[0],   self.center[1], self.center[2],
-                    self.center[0], self.bbox[4],   self.bbox[5]), self._capacity, self._max_depth),
-            Octree((self.center[0], self.bbox[1],   self.bbox[2],
-                    self.bbox[3],   self.center[1], self.center[2]), self._capacity, self._max_depth),
-            Octree((self.center[0], self.bbox[1],   self.center[2],
-                    self.bbox[3],   self.center[1], self.bbox[5]), self._capacity, self._max_depth),
-            Octree((self.center[0], self.center[1], self.bbox[2],
-                    self.bbox[3],   self.bbox[4],   self.center[2]), self._capacity, self._max_depth),
-            Octree((self.center[0], self.center[1], self.center[2],
-                    self.bbox[3],   self.bbox[4],   self.bbox[5]), self._capacity, self._max_depth),
+            self._create_child((b[0], b[1], b[2], cx, cy, cz)),
+            self._create_child((b[0], b[1], cz, cx, cy, b[5])),
+            self._create_child((b[0], cy, b[2], cx, b[4], cz)),
+            self._create_child((b[0], cy, cz, cx, b[4], b[5])),
+            self._create_child((cx, b[1], b[2], b[3], cy, cz)),
+            self._create_child((cx, b[1], cz, b[3], cy, b[5])),
+            self._create_child((cx, cy, b[2], b[3], b[4], cz)),
+            self._create_child((cx, cy, cz, b[3], b[4], b[5])),
         ]
-        for child in self.children:
-            child.depth = self.depth + 1
-            child.parent = self
+
+    def _create_child(self, bbox):
+        child = type(self).__new__(type(self))
+        child._init_node(bbox, self._config)
+        return child
 
     @staticmethod
     def _is_point_inside(bbox, point):
@@ -159,6 +401,15 @@ class Octree:
                 bbox[1] <= point[1] <= bbox[4] and
                 bbox[2] <= point[2] <= bbox[5])
 
+    @staticmethod
+    def _rect_equal(bbox1, bbox2):
+        return (bbox1[0] == bbox2[0] and
+                bbox1[1] == bbox2[1] and
+                bbox1[2] == bbox2[2] and
+                bbox1[3] == bbox2[3] and
+                bbox1[4] == bbox2[4] and
+                bbox1[5] == bbox2[5])
+
     @staticmethod
     def _rect_overlap(bbox1, bbox2):
         return (bbox1[0] <= bbox2[3] and
@@ -0,0 +1,162 @@
+import math
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple, Optional
+
+import numpy
+
+
+def build_parallel(cls, bbox: Tuple[float, ...], bboxes, items=None,
+                   capacity: int = 10, max_depth: int = 20,
+                   workers: Optional[int] = None, levels: Optional[int] = None, masks=None):
+    """Builds a Quadtree or Octree from many bounding boxes using a process pool.
+
+    The first levels of the tree are partitioned in this process, after which every
+    subtree below them is built by sequential insertion in a worker and grafted back
+    under the shared root. Splits follow the same rules as `insert`, so the result is
+    identical to inserting the items one by one in the given order.
+
+    Args:
+        cls: Tree class to build, Quadtree or Octree
+        bbox: Tree bounding box
+        bboxes: Bounding boxes of the items, one row per item. The tree stores these
+                objects, except for the rows of an array which are stored as tuples
+        items: Items connected to each bounding box (default: the row index)
+        capacity: Capacity of each branch (default: 10)
+        max_depth: Maximum depth until tree stops splitting into new regions
+        workers: Number of worker processes (default: number of CPUs)
+        levels: Number of levels partitioned before handing subtrees to workers
+                (default: enough levels to give every worker a few subtrees)
+        masks: Category bits of each item (default: all categories)
+    Returns:
+        The built tree
+    """
+    dims = len(bbox) // 2
+    boxes = numpy.asarray(bboxes, dtype=float).reshape(-1, 2 * dims)
+    if items is None:
+        items = list(range(len(boxes)))
+    masks = numpy.full(len(boxes), -1, dtype=numpy.int64) if masks is None else numpy.asarray(masks, dtype=numpy.int64)
+    workers = workers or os.cpu_count() or 1
+    if levels is None:
+        levels = 1
+        while (2 ** dims) ** levels < 4 * workers:
+            levels += 1
+    tree = cls(bbox, capacity, max_depth)
+    inside = numpy.ones(len(boxes), dtype=bool)
+    for j in range(dims):
+        inside &= (boxes[:, j] <= bbox[dims + j]) & (boxes[:, dims + j] >= bbox[j])
+    # Entries keep the caller's bbox objects, rows of an array are stored as tuples
+    if isinstance(bboxes, numpy.ndarray) or len(bboxes) != len(boxes):
+        rects = [tuple(b) for b in boxes.tolist()]
+    else:
+        rects = list(bboxes)
+    entries = list(zip(items, rects, masks.tolist()))
+    jobs = []
+    _partition(tree, 0, boxes, masks, numpy.flatnonzero(inside), entries, levels, jobs)
+
+    if workers > 1 and len(jobs) > 1:
+        tasks = [(cls, node.bbox, depth, capacity, max_depth, idx, boxes[idx], masks[idx])
+                 for node, depth, idx in jobs]
+        with ProcessPoolExecutor(workers) as pool:
+            layouts = list(pool.map(_build_subtree, tasks))
+        for (node, _, _), layout in zip(jobs, layouts):
+            _graft(node, layout, entries)
+    else:
+        for node, depth, idx in jobs:
+            for i in idx.tolist():
+                node._insert(*entries[i], depth)
+    # Item counts are computed on the first density query
+    tree.count = None
+    return tree
+
+
+def _partition(node, depth: int, boxes, masks, idx, entries, levels: int, jobs: list):
+    """Splits node the way sequential insertion of boxes[idx] would."""
+    config = node._config
+    rows = boxes[idx]
+    dims = len(node.center)
+    if len(idx):
+        node.mask = int(numpy.bitwise_or.reduce(masks[idx]))
+    center = numpy.asarray(node.center)
+    low = rows[:, :dims] <= center
+    high = rows[:, dims:] >= center
+    # An overflow bucket, see Quadtree._is_overflow
+    overflow = len(idx) and (((low & high)[0].any() and (low == low[0]).all() and (high == high[0]).all()) or
+                             (rows == rows[0]).all())
+    if depth == config.max_depth or len(idx) <= config.capacity or overflow:
+        node.points = [entries[i] for i in idx.tolist()] or None
+        return
+    if levels == 0:
+        # The worker recomputes the masks and contents of the subtree, including this node
+        jobs.append((node, depth, idx))
+        return
+    straddle = (low & high).all(axis=1)
+    node._create_children()
+    node.content = _content(node.bbox, rows, dims)
+    node.points = [entries[i] for i in idx[straddle].tolist()] or None
+    for k, child in enumerate(node.children):
+        selected = ~straddle
+        for j in range(dims):
+            selected &= high[:, j] if (k >> (dims - 1 - j)) & 1 else low[:, j]
+        _partition(child, depth + 1, boxes, masks, idx[selected], entries, levels - 1, jobs)
+
+
+def _build_subtree(task):
+    """Builds a subtree by sequential insertion and returns its layout.
+
+    Row indices are inserted in place of the items, and the subtree is flattened
+    in preorder to a split flag, mask, content bounds and entry count per node plus
+    the entry row indices, which is far cheaper to send back than the pickled nodes.
+    Leaves have NaN content bounds.
+    """
+    cls, bbox, depth, capacity, max_depth, idx, boxes, masks = task
+    subtree = cls(bbox, capacity, max_depth)
+    for i, rect, mask in zip(idx.tolist(), boxes.tolist(), masks.tolist()):
+        subtree._insert(i, tuple(rect), mask, depth)
+    split = bytearray()
+    node_masks = array('q')
+    contents = array('d')
+    counts = array('q')
+    indices = array('q')
+    empty = [math.nan] * len(bbox)
+    nodes = [subtree]
+    while nodes:
+        node = nodes.pop()
+        points = node.points or ()
+        counts.append(len(points))
+        indices.extend(i for i, _, _ in points)
+        node_masks.append(node.mask)
+        contents.extend(node.content or empty)
+        split.append(1 if node.children else 0)
+        if node.children:
+            nodes.extend(reversed(node.children))
+    return split, node_masks, contents, counts, indices
+
+
+def _graft(node, layout, entries):
+    """Recreates a subtree layout from `_build_subtree` below node."""
+    split, node_masks, contents, counts, indices = layout
+    width = len(node.bbox)
+    contents = contents.tolist()
+    indices = indices.tolist()
+    pos = 0
+    nodes = [node]
+    for k, (has_children, mask, count) in enumerate(zip(split, node_masks, counts)):
+        n = nodes.pop()
+        n.mask = mask
+        if not math.isnan(contents[k * width]):
+            n.content = tuple(contents[k * width:(k + 1) * width])
+        if count:
+            n.points = [entries[i] for i in indices[pos:pos + count]]
+            pos += count
+        if has_children:
+            n._create_children()
+            nodes.extend(reversed(n.children))
+
+
+def _content(bbox, rows, dims: int) -> tuple:
+    """Content bounds of a node holding the boxes of rows, see `Quadtree._grow_content`."""
+    low = numpy.maximum(rows[:, :dims].min(axis=0), bbox[:dims])
+    high = numpy.minimum(rows[:, dims:].max(axis=0), bbox[dims:])
+    return tuple(low.tolist() + high.tolist())
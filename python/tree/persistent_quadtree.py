@@ -0,0 +1,166 @@
+from typing import Tuple, Optional
+
+from .config import TreeConfig
+from .quadtree import Quadtree
+
+
+class PersistentQuadtree(Quadtree):
+    """Quadtree where every modification returns a new version of the tree.
+
+    `insert` and `remove` copy only the nodes on the paths from the root to the
+    modified leaves, every other node is shared with the previous version. All
+    versions stay valid and can be queried with `intersect` like a Quadtree, which
+    makes it cheap to keep one version per simulation frame for rollback and replay.
+
+    Nodes must not be modified in place, as they may be shared between versions.
+    """
+    __slots__ = ()
+
+    def insert(self, item, bbox: Tuple[float, float, float, float], mask: int = -1) -> "PersistentQuadtree":
+        """Creates a new version of the tree with an item added.
+
+        :param item: Data to connect to this bounding box
+        :param bbox: Bounding box of the item
+        :param mask: Category bits of the item (default: all categories)
+        :return: The new version, or this version if bbox is outside the tree
+        """
+        if not self._rect_overlap(self.bbox, bbox):
+            return self
+        root = self._copy()
+        root._insert(item, bbox, mask, 0)
+        return root
+
+    def remove(self, item, bbox: Tuple[float, float, float, float]) -> "PersistentQuadtree":
+        """Creates a new version of the tree with an item removed.
+
+        :param item: Item to remove, matched by identity
+        :param bbox: Bounding box the item was inserted with
+        :return: The new version, or this version if the item is not in the tree
+        """
+        if not self._rect_overlap(self.bbox, bbox):
+            return self
+        root = self._copy()
+        if not root._remove(item, bbox):
+            return self
+        return root
+
+    def rebalance(self, capacity: Optional[int] = None) -> "PersistentQuadtree":
+        """Creates a rebuilt version of the tree.
+
+        See `Quadtree.rebalance`.
+
+        :param capacity: New capacity of each branch (default: keep the current capacity)
+        :return: The rebuilt version
+        """
+        root = self._copy()
+        config = self._config
+        root._config = TreeConfig(config.capacity, config.max_depth)
+        super(PersistentQuadtree, root).rebalance(capacity)
+        return root
+
+    def _copy(self) -> "PersistentQuadtree":
+        """Creates a copy of this node, private to the version being created."""
+        node = type(self).__new__(type(self))
+        node._config = self._config
+        node.bbox = self.bbox
+        node.children = list(self.children) if self.children else None
+        node.points = list(self.points) if self.points else None
+        node.mask = self.mask
+        node.content = self.content
+        # Recomputed by density, the copy is about to be modified
+        node.count = None
+        return node
+
+    def _child_copy(self, index: int) -> "PersistentQuadtree":
+        child = self.children[index]._copy()
+        self.children[index] = child
+        return child
+
+    def _insert(self, item, bbox: Tuple[float, float, float, float], mask: int, depth: int):
+        if not self.children:
+            super()._insert(item, bbox, mask, depth)
+            return
+        # One level per call, so _insert_to_children copies every node on the path
+        self.mask |= mask
+        c = self.content
+        if bbox[0] < c[0] or bbox[1] < c[1] or bbox[2] > c[2] or bbox[3] > c[3]:
+            self._grow_content(bbox)
+        self._insert_to_children(item, bbox, mask, depth)
+
+    def _insert_to_children(self, item, rect: Tuple[float, float, float, float], mask: int, depth: int):
+        # Same routing as Quadtree, copying every child the entry descends into
+        cx, cy = self.center
+        if (rect[0] <= cx <= rect[2] and rect[1] <= cy <= rect[3]):
+            if self.points is None:
+                self.points = [(item, rect, mask)]
+            else:
+                self.points.append((item, rect, mask))
+        else:
+            depth += 1
+            if rect[0] <= cx:
+                if rect[1] <= cy:
+                    self._child_copy(0)._insert(item, rect, mask, depth)
+                if rect[3] >= cy:
+                    self._child_copy(1)._insert(item, rect, mask, depth)
+            if rect[2] >= cx:
+                if rect[1] <= cy:
+                    self._child_copy(2)._insert(item, rect, mask, depth)
+                if rect[3] >= cy:
+                    self._child_copy(3)._insert(item, rect, mask, depth)
+
+    def _remove(self, item, rect: Tuple[float, float, float, float]) -> bool:
+        cx, cy = self.center
+        if not self.children or (rect[0] <= cx <= rect[2] and rect[1] <= cy <= rect[3]):
+            for i, (obj, pt, _) in enumerate(self.points or ()):
+                if obj is item and self._rect_equal(pt, rect):
+                    del self.points[i]
+                    if not self.points:
+                        self.points = None
+                    self._update_mask()
+                    self._update_content()
+                    return True
+            return False
+        removed = False
+        if rect[0] <= cx:
+            if rect[1] <= cy:
+                removed |= self._remove_from_child(0, item, rect)
+            if rect[3] >= cy:
+                removed |= self._remove_from_child(1, item, rect)
+        if rect[2] >= cx:
+            if rect[1] <= cy:
+                removed |= self._remove_from_child(2, item, rect)
+            if rect[3] >= cy:
+                removed |= self._remove_from_child(3, item, rect)
+        if removed:
+            self._collapse()
+            self._update_mask()
+            self._update_content()
+        return removed
+
+    def _remove_from_child(self, index: int, item, rect) -> bool:
+        child = self.children[index]._copy()
+        if not child._remove(item, rect):
+            return False
+        self.children[index] = child
+        return True
+
+    def _collapse(self):
+        """Turns this node back into a leaf once its entries fit in one."""
+        if any(child.children for child in self.children):
+            return
+        entries = {}
+        for node in (self, *self.children):
+            for obj, pt, obj_mask in node.points or ():
+                entries[(id(obj), id(pt))] = (obj, pt, obj_mask)
+        if len(entries) <= self._config.capacity:
+            self.children = None
+            self.points = list(entries.values()) or None
+
+    def _update_mask(self):
+        """Recomputes the mask of this node after entries were removed below it."""
+        mask = 0
+        for _, _, obj_mask in self.points or ():
+            mask |= obj_mask
+        for child in self.children or ():
+            mask |= child.mask
+        self.mask = mask
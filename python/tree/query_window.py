@@ -0,0 +1,128 @@
+from typing import Tuple, Optional, List, Set
+
+import numpy
+
+from .id_quadtree import IdQuadtree
+
+
+class QueryWindow:
+    """Stateful query region that reports the items entering and leaving it as it moves.
+
+    Consecutive positions of a moving window usually overlap almost entirely, so instead
+    of querying the whole new region, `move` only traverses the parts of the tree
+    covered by one of the two regions but not by the other. The cost of a move is then
+    proportional to the change rather than to the size of the window.
+
+    Works on Quadtree, Octree and NTree. The tree is expected to stay unchanged
+    between moves, items inserted in the meantime are only reported once a region
+    containing them is traversed.
+
+    How to use:
+        window = QueryWindow(tree, (0, 0, 100, 100))
+        entered, exited = window.move((5, 0, 105, 100))
+    """
+
+    def __init__(self, tree, bbox: Optional[Tuple[float, ...]] = None):
+        """
+        Args:
+            tree: Tree to query
+            bbox: Initial region of the window (default: empty window)
+        Raises:
+            TypeError: If tree is an IdQuadtree, whose nodes hold no item entries
+        """
+        if isinstance(tree, IdQuadtree):
+            raise TypeError("QueryWindow does not support IdQuadtree, use a Quadtree instead")
+        self._tree = tree
+        self._root = tuple(numpy.ravel(tree.bbox).tolist())
+        self._dims = len(self._root) // 2
+        self._native = isinstance(tree.bbox, numpy.ndarray)
+        self._items = {}
+        self.bbox = None
+        if bbox is not None:
+            self.move(bbox)
+
+    @property
+    def items(self) -> List:
+        """Items currently overlapping the window."""
+        return list(self._items.values())
+
+    def move(self, bbox: Tuple[float, ...]) -> Tuple[Set, Set]:
+        """Moves the window to a new region.
+
+        Args:
+            bbox: New region of the window
+        Returns:
+            Tuple (entered, exited) with the sets of items which started and stopped
+            overlapping the window
+        """
+        bbox = tuple(bbox)
+        old = self.bbox
+        self.bbox = bbox
+        if (old is None or not self._overlap(old, bbox) or
+                not self._overlap(old, self._root) or not self._overlap(bbox, self._root)):
+            return self._reset(bbox)
+        overlap = self._tree._rect_overlap
+        native_old, native_new = self._to_native(old), self._to_native(bbox)
+        entered = {}
+        for obj, pt in self._entries(self._difference(bbox, old)):
+            if not overlap(pt, native_old):
+                entered[id(obj)] = obj
+        exited = {}
+        for obj, pt in self._entries(self._difference(old, bbox)):
+            if not overlap(pt, native_new):
+                exited[id(obj)] = obj
+        for obj_id in exited:
+            self._items.pop(obj_id, None)
+        self._items.update(entered)
+        return set(entered.values()), set(exited.values())
+
+    def _reset(self, bbox):
+        """Replaces the items of the window by a full query of bbox."""
+        items = {id(obj): obj for obj in self._tree.intersect(bbox)}
+        entered = {obj for obj_id, obj in items.items() if obj_id not in self._items}
+        exited = {obj for obj_id, obj in self._items.items() if obj_id not in items}
+        self._items = items
+        return entered, exited
+
+    def _entries(self, rects):
+        """Yields the (item, bbox) entries of the tree overlapping any of rects."""
+        overlap = self._tree._rect_overlap
+        rects = [self._to_native(r) for r in rects]
+        nodes = [self._tree]
+        while nodes:
+            node = nodes.pop()
+            if node.children:
+                for child in node.children:
+                    if any(overlap(child.bbox, r) for r in rects):
+                        nodes.append(child)
+            for obj, pt, _ in node.points or ():
+                if any(overlap(pt, r) for r in rects):
+                    yield obj, pt
+
+    def _difference(self, bbox, other) -> List[Tuple[float, ...]]:
+        """Splits the part of bbox outside of other into boxes, one slab per side."""
+        dims = self._dims
+        low, high = list(bbox[:dims]), list(bbox[dims:])
+        pieces = []
+        for j in range(dims):
+            if low[j] < other[j]:
+                piece_high = list(high)
+                piece_high[j] = other[j]
+                pieces.append((*low, *piece_high))
+                low[j] = other[j]
+            if high[j] > other[dims + j]:
+                piece_low = list(low)
+                piece_low[j] = other[dims + j]
+                pieces.append((*piece_low, *high))
+                high[j] = other[dims + j]
+        return pieces
+
+    def _overlap(self, bbox1, bbox2):
+        dims = self._dims
+        return all(bbox1[j] <= bbox2[dims + j] and bbox1[dims + j] >= bbox2[j] for j in range(dims))
+
+    def _to_native(self, bbox):
+        """Converts a flat bounding box to the representation used by the tree nodes."""
+        if self._native:
+            return numpy.array(bbox).reshape(2, self._dims)
+        return bbox
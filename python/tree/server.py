@@ -0,0 +1,382 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import socket
+import struct
+import threading
+from typing import Tuple, List
+
+import numpy
+
+from .id_quadtree import IdQuadtree
+
+MAGIC = b"QTSV"
+VERSION = 2
+
+INSERT, INTERSECT, NEAREST = range(3)
+
+# Sent by the server when a client connects: magic, version and tree dimensions
+_HANDSHAKE = struct.Struct("<4sBB")
+# Request id, operation, mask and argument (item id of an insert, k of a nearest query),
+# followed by the bounding box (insert, intersect) or point (nearest) as doubles
+_REQUEST = struct.Struct("<IBqQ")
+# Request id and number of items, followed by the item ids as unsigned 64 bit integers.
+# Inserts are answered without ids, the count being 1 if the item was accepted
+_RESPONSE = struct.Struct("<II")
+# Count of a failed request, followed by the length of the error message and the message
+_FAILED = 2 ** 32 - 1
+_LENGTH = struct.Struct("<I")
+
+_logger = logging.getLogger(__name__)
+
+
+class TreeServer:
+    """Serves a single tree to other processes over a Unix domain socket.
+
+    Items are unsigned 64 bit integer ids chosen by the clients. Requests arriving while
+    the previous batch is executed are executed together: consecutive intersect queries
+    of a batch share a single traversal of the tree, which visits each node once for all
+    the queries reaching it. Requests are executed in the order they were received, so a
+    query always sees the inserts sent before it. A request that fails is logged and
+    answered with the error, which the client raises as a RuntimeError.
+
+    Works on Quadtree, Octree and NTree.
+
+    How to use:
+        server = TreeServer(Tree((0, 0, 512, 512)), "/tmp/tree.sock")
+        asyncio.run(server.serve_forever())
+
+        client = TreeClient("/tmp/tree.sock")
+        client.insert(42, (10, 10, 20, 20))
+        ids = client.intersect((0, 0, 100, 100))
+    """
+
+    def __init__(self, tree, path: str):
+        """
+        Args:
+            tree: Tree to serve
+            path: Path of the Unix domain socket
+        Raises:
+            TypeError: If tree is an IdQuadtree, whose nodes hold no item entries
+        """
+        if isinstance(tree, IdQuadtree):
+            raise TypeError("TreeServer does not support IdQuadtree, use a Quadtree instead")
+        self.tree = tree
+        self.path = path
+        self._native = isinstance(tree.bbox, numpy.ndarray)
+        self._dims = numpy.size(tree.bbox) // 2
+        self._values = struct.Struct("<%dd" % (2 * self._dims))
+        self._point = struct.Struct("<%dd" % self._dims)
+        self._pending = []
+        self._wakeup = None
+        self._stop = None
+        self._loop = None
+        # Set once the socket accepts connections
+        self.ready = threading.Event()
+
+    async def serve_forever(self):
+        """Serves requests until stop() is called."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stop = asyncio.Event()
+        server = await asyncio.start_unix_server(self._handle, path=self.path)
+        batcher = asyncio.ensure_future(self._batcher())
+        self.ready.set()
+        try:
+            await self._stop.wait()
+        finally:
+            batcher.cancel()
+            server.close()
+            await server.wait_closed()
+            self.ready.clear()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def stop(self):
+        """Stops the server, can be called from any thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        writer.write(_HANDSHAKE.pack(MAGIC, VERSION, self._dims))
+        try:
+            while True:
+                request_id, op, mask, arg = _REQUEST.unpack(await reader.readexactly(_REQUEST.size))
+                values = self._point if op == NEAREST else self._values
+                target = values.unpack(await reader.readexactly(values.size))
+                self._pending.append((writer, request_id, op, mask, arg, target))
+                self._wakeup.set()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _batcher(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            batch, self._pending = self._pending, []
+            try:
+                responses = self._execute(batch)
+            except Exception:
+                # The clients of the batch would wait forever for their responses
+                _logger.exception("Failed to execute a batch of %d requests", len(batch))
+                for writer in {request[0] for request in batch}:
+                    writer.close()
+                continue
+            writers = set()
+            for writer, data in responses:
+                if not writer.is_closing():
+                    writer.write(data)
+                    writers.add(writer)
+            for writer in writers:
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    pass
+
+    def _execute(self, batch):
+        """Runs a batch of requests in order, returning (writer, response) pairs."""
+        responses = []
+        queries = []
+        for request in batch + [None]:
+            if request is not None and request[2] == INTERSECT:
+                queries.append(request)
+                continue
+            if queries:
+                responses.extend(self._execute_intersects(queries))
+                queries = []
+            if request is None:
+                break
+            writer, request_id, op, mask, arg, target = request
+            try:
+                if op == INSERT:
+                    accepted = self.tree.insert(arg, target, mask) is not False
+                    data = _RESPONSE.pack(request_id, int(accepted))
+                elif op == NEAREST:
+                    data = self._response(request_id, self._nearest(target, arg, mask))
+                else:
+                    raise ValueError("Unknown operation %d" % op)
+            except Exception as e:
+                data = self._failure(request_id, e)
+            responses.append((writer, data))
+        return responses
+
+    def _execute_intersects(self, queries):
+        """Runs consecutive intersect requests together, returning (writer, response) pairs."""
+        try:
+            results = self._intersect_batch([(self._to_native(q[5]), q[3]) for q in queries])
+        except Exception as e:
+            return [(q[0], self._failure(q[1], e)) for q in queries]
+        responses = []
+        for q, ids in zip(queries, results):
+            try:
+                data = self._response(q[1], ids)
+            except Exception as e:
+                data = self._failure(q[1], e)
+            responses.append((q[0], data))
+        return responses
+
+    def _intersect_batch(self, queries) -> List[List[int]]:
+        """Runs several intersect queries in a single traversal of the tree.
+
+        Each node is visited once for all the queries reaching it. A query containing the
+        content bounds of a node takes the whole subtree without further checks and leaves
+        the traversal there, the same shortcut a single intersect takes, and a subtree
+        reached by a single query is left to that query's own intersect.
+        """
+        tree = self.tree
+        overlap = tree._rect_overlap
+        contains = tree._rect_contains
+        # Leaves and NTree nodes keep no content bounds, their bbox bounds their entries instead
+        bounded = hasattr(tree, "content")
+        results = [[] for _ in queries]
+        seen = [set() for _ in queries]
+        stack = [(tree, range(len(queries)))]
+        while stack:
+            node, active = stack.pop()
+            bounds = (node.content or node.bbox) if bounded else node.bbox
+            reaching = []
+            for i in active:
+                bbox, mask = queries[i]
+                if not node.mask & mask or not overlap(bounds, bbox):
+                    continue
+                if contains(bbox, bounds):
+                    results[i].extend(node._iter(seen[i], mask))
+                else:
+                    reaching.append(i)
+            if not reaching:
+                continue
+            if len(reaching) == 1:
+                # Nothing left to share, the query finishes the subtree on its own
+                bbox, mask = queries[reaching[0]]
+                results[reaching[0]].extend(node._query_rect(bbox, seen[reaching[0]], mask))
+                continue
+            if node.children:
+                stack.extend((child, reaching) for child in node.children)
+            points = node.points
+            if points:
+                for i in reaching:
+                    bbox, mask = queries[i]
+                    uniq, found = seen[i], results[i]
+                    for obj, pt, obj_mask in points:
+                        if obj_mask & mask and overlap(bbox, pt):
+                            obj_id = id(obj)
+                            if obj_id not in uniq:
+                                uniq.add(obj_id)
+                                found.append(obj)
+        return results
+
+    def _nearest(self, point, k: int, mask: int) -> List[int]:
+        """Returns the k items closest to a point, visiting nodes in order of distance."""
+        root = numpy.ravel(self.tree.bbox).tolist()
+        # Entries may extend past the tree bounds. The closest point of an entry to a point
+        # outside the tree can then lie outside as well, beyond the nodes on that border
+        border = None if self._distance(point, root) == 0 else root
+        counter = itertools.count()
+        heap = [(0.0, next(counter), self.tree, None)]
+        seen = set()
+        found = []
+        while heap and len(found) < k:
+            _, _, node, obj = heapq.heappop(heap)
+            if node is None:
+                if id(obj) not in seen:
+                    seen.add(id(obj))
+                    found.append(obj)
+                continue
+            if not node.mask & mask:
+                continue
+            for child in node.children or ():
+                heapq.heappush(heap, (self._distance(point, child.bbox, border), next(counter), child, None))
+            for obj, pt, obj_mask in node.points or ():
+                if obj_mask & mask:
+                    heapq.heappush(heap, (self._distance(point, pt), next(counter), None, obj))
+        return found
+
+    def _distance(self, point, bbox, border=None) -> float:
+        """Squared distance between a point and the closest point of a bounding box.
+
+        Sides of bbox lying on the same side of the border box are left unbounded.
+        """
+        if self._native:
+            bbox = numpy.ravel(bbox).tolist()
+        dims = self._dims
+        total = 0.0
+        for j in range(dims):
+            if point[j] < bbox[j]:
+                if border is None or bbox[j] != border[j]:
+                    total += (bbox[j] - point[j]) ** 2
+            elif point[j] > bbox[dims + j]:
+                if border is None or bbox[dims + j] != border[dims + j]:
+                    total += (point[j] - bbox[dims + j]) ** 2
+        return total
+
+    def _to_native(self, bbox):
+        """Converts a flat bounding box to the representation used by the tree nodes."""
+        if self._native:
+            return numpy.array(bbox).reshape(2, self._dims)
+        return bbox
+
+    @staticmethod
+    def _response(request_id: int, ids: List[int]) -> bytes:
+        return _RESPONSE.pack(request_id, len(ids)) + struct.pack("<%dQ" % len(ids), *ids)
+
+    @staticmethod
+    def _failure(request_id: int, error: Exception) -> bytes:
+        _logger.error("Request %d failed", request_id, exc_info=error)
+        message = ("%s: %s" % (type(error).__name__, error)).encode()
+        return _RESPONSE.pack(request_id, _FAILED) + _LENGTH.pack(len(message)) + message
+
+
+class TreeClient:
+    """Blocking client of a TreeServer, keeping a single connection open.
+
+    Methods sending several requests at once write all of them before reading the
+    responses, so the server can batch them into one traversal. A request failing on
+    the server raises a RuntimeError with the error reported by the server.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Path of the Unix domain socket of the server
+        """
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._file = self._socket.makefile("rb")
+        magic, version, self.dims = _HANDSHAKE.unpack(self._read(_HANDSHAKE.size))
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ConnectionError("%s is not a version %d tree server" % (path, VERSION))
+        self._next_id = 0
+
+    def insert(self, item: int, bbox: Tuple[float, ...], mask: int = -1) -> bool:
+        """Inserts an item id into the served tree.
+
+        Returns:
+            True if the bounding box overlaps the tree region, False otherwise
+        """
+        return bool(self._request([(INSERT, mask, item, bbox)])[0])
+
+    def intersect(self, bbox: Tuple[float, ...], mask: int = -1) -> List[int]:
+        """Returns the ids of the items overlapping a bounding box."""
+        return self._request([(INTERSECT, mask, 0, bbox)])[0]
+
+    def intersect_many(self, bboxes, mask: int = -1) -> List[List[int]]:
+        """Returns the ids of the items overlapping each of several bounding boxes."""
+        return self._request([(INTERSECT, mask, 0, bbox) for bbox in bboxes])
+
+    def nearest(self, point: Tuple[float, ...], k: int = 1, mask: int = -1) -> List[int]:
+        """Returns the ids of the k items closest to a point, closest first."""
+        return self._request([(NEAREST, mask, k, point)])[0]
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _request(self, requests) -> list:
+        first = self._next_id
+        data = []
+        for op, mask, arg, values in requests:
+            # Masks are sent as signed 64 bit integers, so -1 stays "all categories"
+            mask = (mask + 2 ** 63) % 2 ** 64 - 2 ** 63
+            data.append(_REQUEST.pack(self._next_id, op, mask, arg))
+            data.append(struct.pack("<%dd" % len(values), *values))
+            self._next_id = (self._next_id + 1) % 2 ** 32
+        self._socket.sendall(b"".join(data))
+        results = []
+        error = None
+        for i in range(len(requests)):
+            request_id, count = _RESPONSE.unpack(self._read(_RESPONSE.size))
+            if request_id != (first + i) % 2 ** 32:
+                raise ConnectionError("Unexpected response %d from the tree server" % request_id)
+            if count == _FAILED:
+                # Read the remaining responses before raising, keeping the connection usable
+                length, = _LENGTH.unpack(self._read(_LENGTH.size))
+                error = error or RuntimeError("Tree server request failed: %s" % self._read(length).decode())
+            elif requests[i][0] == INSERT:
+                results.append(count)
+            else:
+                results.append(list(struct.unpack("<%dQ" % count, self._read(8 * count))))
+        if error is not None:
+            raise error
+        return results
+
+    def _read(self, size: int) -> bytes:
+        data = self._file.read(size)
+        if len(data) != size:
+            raise ConnectionError("Connection closed by the tree server")
+        return data
+
+
+def serve(tree, path: str):
+    """Serves a tree over a Unix domain socket until interrupted."""
+    asyncio.run(TreeServer(tree, path).serve_forever())
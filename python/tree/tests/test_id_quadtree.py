@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+import numpy
+
+from tree.quadtree import Quadtree
+from tree.id_quadtree import IdQuadtree
+from tree.query_window import QueryWindow
+from tree.server import TreeServer
+
+
+class TestIdQuadtree(unittest.TestCase):
+    def setUp(self):
+        random.seed(1234)
+        self.quadtree = Quadtree((0, 0, 100, 100), capacity=4)
+        self.idtree = IdQuadtree((0, 0, 100, 100), capacity=4)
+        for i in range(2000):
+            x, y = random.uniform(-5, 100), random.uniform(0, 100)
+            w = random.choice([0, 0, 0, random.uniform(0, 10)])
+            if i % 5 == 0:
+                x, y, w = 50, 50, 0
+            self.quadtree.insert(i, (x, y, x + w, y + w))
+            self.idtree.insert(i, (x, y, x + w, y + w))
+
+    def test_matches_quadtree(self):
+        for _ in range(200):
+            x, y = random.uniform(-10, 100), random.uniform(-10, 100)
+            bbox = (x, y, x + random.uniform(0, 50), y + random.uniform(0, 50))
+            ids = self.idtree.intersect_ids(bbox)
+            self.assertEqual(ids.dtype, numpy.int64)
+            self.assertEqual(ids.tolist(), sorted(self.quadtree.intersect(bbox)))
+
+    def test_query_modes_match_quadtree(self):
+        for _ in range(100):
+            x, y = random.uniform(-10, 100), random.uniform(-10, 100)
+            bbox = (x, y, x + random.uniform(0, 50), y + random.uniform(0, 50))
+            self.assertEqual(list(self.idtree.within(bbox)), sorted(self.quadtree.within(bbox)))
+            small = (x, y, x + random.uniform(0, 2), y + random.uniform(0, 2))
+            self.assertEqual(list(self.idtree.enclosing(small)), sorted(self.quadtree.enclosing(small)))
+            self.assertEqual(list(self.idtree.stab((x, y))), sorted(self.quadtree.stab((x, y))))
+        self.assertEqual(self.idtree.stab_ids((50, 50)).tolist(), sorted(self.quadtree.stab((50, 50))))
+        self.assertTrue(len(self.idtree.stab_ids((50, 50))))
+
+    def test_density_matches_quadtree(self):
+        for query, shape in (((0, 0, 100, 100), (8, 8)), ((12.5, 20, 62.5, 70), (3, 5)), ((-20, -20, 40, 40), (4, 2))):
+            grid = self.idtree.density(query, shape)
+            self.assertEqual(grid.dtype, numpy.int64)
+            self.assertEqual(grid.tolist(), self.quadtree.density(query, shape).tolist())
+        self.assertGreater(self.idtree.density((0, 0, 100, 100), (1, 1))[0, 0], 0)
+
+    def test_iter(self):
+        ids = list(self.idtree)
+        self.assertGreater(len(ids), 1900)
+        self.assertEqual(ids, sorted(self.quadtree))
+
+    def test_node_tools_unsupported(self):
+        self.assertFalse(hasattr(IdQuadtree, "build_parallel"))
+        with self.assertRaises(TypeError):
+            QueryWindow(self.idtree, (0, 0, 10, 10))
+        with self.assertRaises(TypeError):
+            TreeServer(self.idtree, "unused.sock")
+
+    def test_explicit_ids(self):
+        tree = IdQuadtree((0, 0, 10, 10))
+        self.assertEqual(tree.insert(None, (1, 1, 1, 1)), 0)
+        self.assertEqual(tree.insert(7, (1, 1, 1, 1)), 7)
+        self.assertEqual(tree.insert(None, (2, 2, 2, 2)), 8)
+        self.assertIsNone(tree.insert(None, (20, 20, 20, 20)))
+        self.assertEqual(list(tree.intersect((0, 0, 5, 5))), [0, 7, 8])
+
+    def test_rebalance(self):
+        bbox = (20, 20, 60, 60)
+        expected = self.idtree.intersect_ids(bbox).tolist()
+        self.idtree.rebalance()
+        self.assertEqual(self.idtree.intersect_ids(bbox).tolist(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import pickle
+import random
+import unittest
+
+import numpy
+
+from tree.quadtree import Quadtree
+from tree.linear_quadtree import LinearQuadtree
+
+
+class TestLinearQuadtree(unittest.TestCase):
+    def setUp(self):
+        random.seed(1234)
+        self.quadtree = Quadtree((0, 0, 100, 100), capacity=8)
+        self.linear = LinearQuadtree((0, 0, 100, 100), capacity=8)
+        for i in range(2000):
+            x, y = random.uniform(-5, 100), random.uniform(0, 100)
+            w = random.choice([0, 0, 0, random.uniform(0, 10)])
+            self.quadtree.insert(i, (x, y, x + w, y + w))
+            self.linear.insert(i, (x, y, x + w, y + w))
+
+    def test_matches_quadtree(self):
+        for _ in range(200):
+            x, y = random.uniform(-10, 100), random.uniform(-10, 100)
+            bbox = (x, y, x + random.uniform(0, 50), y + random.uniform(0, 50))
+            self.assertEqual(sorted(self.linear.intersect(bbox)), sorted(self.quadtree.intersect(bbox)))
+
+    def test_outside(self):
+        self.assertFalse(self.linear.insert(-1, (200, 200, 201, 201)))
+        self.assertEqual(list(self.linear.intersect((200, 200, 300, 300))), [])
+
+    def test_pickle(self):
+        bbox = (20, 20, 40, 30)
+        copy = pickle.loads(pickle.dumps(self.linear))
+        self.assertEqual(sorted(copy.intersect(bbox)), sorted(self.quadtree.intersect(bbox)))
+
+    def test_from_arrays(self):
+        points = numpy.array([[1, 1], [5, 5], [9, 9], [50, 50]], dtype=float)
+        tree = LinearQuadtree.from_arrays((0, 0, 10, 10), numpy.hstack([points, points]))
+        self.assertEqual(sorted(tree.intersect((0, 0, 6, 6))), [0, 1])
+        self.assertEqual(sorted(tree.intersect((0, 0, 100, 100))), [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
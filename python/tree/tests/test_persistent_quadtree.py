@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+from tree.persistent_quadtree import PersistentQuadtree
+
+
+class TestPersistentQuadtree(unittest.TestCase):
+    def setUp(self):
+        random.seed(1234)
+        self.entries = []
+        for i in range(1000):
+            x, y = random.uniform(0, 100), random.uniform(0, 100)
+            w = random.choice([0, 0, random.uniform(0, 10)])
+            self.entries.append((i, (x, y, x + w, y + w)))
+        self.versions = [PersistentQuadtree((0, 0, 100, 100), capacity=4)]
+        for item, bbox in self.entries:
+            self.versions.append(self.versions[-1].insert(item, bbox))
+
+    def test_versions_are_independent(self):
+        query = (10, 10, 70, 70)
+        for n in (0, 1, 10, 500, 1000):
+            expected = sorted(i for i, (x0, y0, x1, y1) in self.entries[:n]
+                              if x0 <= 70 and y0 <= 70 and x1 >= 10 and y1 >= 10)
+            self.assertEqual(sorted(self.versions[n].intersect(query)), expected)
+
+    def test_structural_sharing(self):
+        old, new = self.versions[-2], self.versions[-1]
+        self.assertIsNot(old, new)
+        shared = [a is b for a, b in zip(old.children, new.children)]
+        self.assertEqual(shared.count(True), 3)
+
+    def test_remove(self):
+        tree = self.versions[-1]
+        removed = tree
+        for item, bbox in self.entries[::2]:
+            removed = removed.remove(item, bbox)
+        query = (0, 0, 100, 100)
+        self.assertEqual(sorted(removed.intersect(query)), [i for i, _ in self.entries[1::2]])
+        self.assertEqual(sorted(tree.intersect(query)), [i for i, _ in self.entries])
+        self.assertIs(removed.remove(0, self.entries[0][1]), removed)
+
+    def test_remove_all_collapses(self):
+        tree = self.versions[-1]
+        for item, bbox in self.entries:
+            tree = tree.remove(item, bbox)
+        self.assertIsNone(tree.children)
+        self.assertIsNone(tree.points)
+
+    def test_remove_updates_mask(self):
+        tree = PersistentQuadtree((0, 0, 100, 100), capacity=4)
+        for item, bbox in self.entries:
+            tree = tree.insert(item, bbox, mask=1)
+        marked = tree.insert("marker", (1, 1, 2, 2), mask=2)
+        self.assertEqual(list(marked.intersect((0, 0, 100, 100), mask=2)), ["marker"])
+        self.assertEqual(tree.mask, 1)
+        removed = marked.remove("marker", (1, 1, 2, 2))
+        self.assertEqual(removed.mask, 1)
+        self.assertEqual(removed.children[0].mask, 1)
+        self.assertEqual(list(removed.intersect((0, 0, 100, 100), mask=2)), [])
+
+    def test_remove_shrinks_content(self):
+        tree = PersistentQuadtree((0, 0, 100, 100), capacity=4)
+        for i in range(20):
+            tree = tree.insert(i, (10 + i, 10, 11 + i, 11))
+        outlier = tree.insert("outlier", (90, 90, 95, 95))
+        self.assertEqual(outlier.content, (10, 10, 95, 95))
+        removed = outlier.remove("outlier", (90, 90, 95, 95))
+        self.assertEqual(removed.content, (10, 10, 30, 11))
+        self.assertEqual(list(removed.intersect((50, 50, 100, 100))), [])
+
+    def test_rebalance(self):
+        tree = self.versions[-1]
+        rebalanced = tree.rebalance(capacity=16)
+        query = (20, 20, 40, 90)
+        self.assertEqual(sorted(rebalanced.intersect(query)), sorted(tree.intersect(query)))
+        self.assertEqual(tree._config.capacity, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+import numpy
+
+from tree import Tree
+from tree.quadtree import Quadtree
+from tree.octree import Octree
+
+
+def count_nodes(node):
+    return 1 + sum(count_nodes(c) for c in node.children or ())
+
+
+def nodes(node):
+    yield node
+    for c in node.children or ():
+        yield from nodes(c)
+
+
+def layout(node):
+    """Nested description of a tree, comparable between trees holding the same items."""
+    return (node.bbox, node.mask, [(id(obj), pt, m) for obj, pt, m in node.points or ()],
+            [layout(c) for c in node.children or ()])
+
+
+class TestNodeLayout(unittest.TestCase):
+    def _check(self, tree, dims):
+        random.seed(5)
+        for i in range(500):
+            low = [random.uniform(0, 100) for _ in range(dims)]
+            tree.insert(i, tuple(low + low))
+        all_nodes = list(nodes(tree))
+        self.assertGreater(len(all_nodes), 1)
+        for node in all_nodes:
+            self.assertFalse(hasattr(node, "__dict__"))
+            self.assertIs(node._config, tree._config)
+            if node is not tree:
+                # The center and depth are derived instead of stored in every node
+                self.assertFalse(hasattr(node, "parent") or hasattr(node, "depth"))
+            if node.children:
+                # Points never straddle a split, so only leaves allocate an entry list
+                self.assertIsNone(node.points)
+
+    def test_quadtree(self):
+        self._check(Quadtree((0, 0, 100, 100), capacity=4), 2)
+
+    def test_octree(self):
+        self._check(Octree((0, 0, 0, 100, 100, 100), capacity=4), 3)
+
+    def test_ntree(self):
+        self._check(Tree((0, 0, 0, 0, 100, 100, 100, 100), capacity=4), 4)
+
+
+class TestOverflow(unittest.TestCase):
+    def test_coincident_points_do_not_split(self):
+        tree = Quadtree((0, 0, 512, 512), capacity=4)
+        for i in range(100):
+            tree.insert(i, (10, 10, 10, 10))
+        self.assertEqual(count_nodes(tree), 1)
+        self.assertEqual(len(list(tree.intersect((0, 0, 20, 20)))), 100)
+
+    def test_overflow_bucket_splits_on_distinct_item(self):
+        tree = Quadtree((0, 0, 512, 512), capacity=4)
+        for i in range(100):
+            tree.insert(i, (10, 10, 10, 10))
+        tree.insert(100, (500, 500, 500, 500))
+        self.assertEqual(count_nodes(tree), 5)
+        self.assertEqual(list(tree.intersect((490, 490, 510, 510))), [100])
+        self.assertEqual(len(list(tree.intersect((0, 0, 20, 20)))), 100)
+
+    def test_inseparable_boxes_do_not_split(self):
+        # Boxes meeting on a split line reach both sides of it, every split keeps them together
+        for max_depth in (8, 12):
+            tree = Quadtree((0, 0, 100, 100), capacity=1, max_depth=max_depth)
+            tree.insert(0, (10, 10, 50, 20))
+            tree.insert(1, (50, 10, 90, 20))
+            self.assertEqual(count_nodes(tree), 1)
+            tree = Octree((0, 0, 0, 100, 100, 100), capacity=1, max_depth=max_depth)
+            tree.insert(0, (10, 10, 10, 50, 20, 20))
+            tree.insert(1, (50, 10, 10, 90, 20, 20))
+            self.assertEqual(count_nodes(tree), 1)
+
+    def test_node_count_independent_of_max_depth(self):
+        counts = []
+        for max_depth in (8, 12, 20):
+            random.seed(18)
+            tree = Quadtree((0, 0, 100, 100), capacity=1, max_depth=max_depth)
+            for i in range(50):
+                x, y, w = random.uniform(0, 90), random.uniform(0, 90), random.uniform(0, 10)
+                tree.insert(i, (x, y, x + w, y + w))
+            counts.append(count_nodes(tree))
+        self.assertEqual(len(set(counts)), 1)
+
+    def test_coincident_octree_points_do_not_split(self):
+        tree = Octree((0, 0, 0, 512, 512, 512), capacity=4)
+        for i in range(100):
+            tree.insert(i, (10, 10, 10, 10, 10, 10))
+        self.assertEqual(count_nodes(tree), 1)
+
+    def test_ntree_coincident_points_do_not_split(self):
+        tree = Tree((0, 0, 0, 0, 1, 1, 1, 1), capacity=4)
+        for i in range(50):
+            tree.insert(i, (.5, .5, .5, .5, .5, .5, .5, .5))
+        self.assertEqual(count_nodes(tree), 1)
+
+
+class TestRebalance(unittest.TestCase):
+    def test_rebalance_keeps_items(self):
+        random.seed(1234)
+        tree = Quadtree((0, 0, 1, 1), capacity=4)
+        points = [(random.random(), random.random()) for _ in range(500)]
+        for i, (x, y) in enumerate(points):
+            tree.insert(i, (x, y, x, y))
+        expected = sorted(tree.intersect((.2, .2, .6, .6)))
+        tree.rebalance(capacity=16)
+        self.assertEqual(sorted(tree.intersect((.2, .2, .6, .6))), expected)
+
+    def test_rebalance_keeps_capacity_on_duplicates(self):
+        tree = Quadtree((0, 0, 1, 1), capacity=4)
+        for i in range(200):
+            x = (i % 50) / 50
+            tree.insert(i, (x, x, x, x))
+        nodes_before = count_nodes(tree)
+        tree.rebalance()
+        self.assertEqual(tree._config.capacity, 4)
+        self.assertEqual(count_nodes(tree), nodes_before)
+        self.assertEqual(len(list(tree.intersect((0, 0, 1, 1)))), 200)
+
+
+class TestMask(unittest.TestCase):
+    WALL, NPC, PICKUP = 1, 2, 4
+
+    def setUp(self):
+        random.seed(42)
+        self.tree = Quadtree((0, 0, 100, 100), capacity=4)
+        self.kinds = {}
+        for i in range(500):
+            x, y = random.uniform(0, 95), random.uniform(0, 95)
+            # NPCs only in the lower left corner
+            kind = self.NPC if x < 20 and y < 20 else random.choice((self.WALL, self.PICKUP))
+            self.kinds[i] = kind
+            self.tree.insert(i, (x, y, x + 5, y + 5), kind)
+
+    def test_intersect_filters_by_mask(self):
+        everything = set(self.tree.intersect((0, 0, 100, 100)))
+        self.assertEqual(everything, set(self.kinds))
+        for mask in (self.WALL, self.NPC, self.WALL | self.PICKUP):
+            expected = {i for i, kind in self.kinds.items() if kind & mask}
+            self.assertEqual(set(self.tree.intersect((0, 0, 100, 100), mask)), expected)
+        self.assertEqual(set(self.tree.intersect((60, 60, 100, 100), self.NPC)), set())
+
+    def test_node_mask_is_union_of_subtree(self):
+        def check(node):
+            mask = 0
+            for _, _, m in node.points or ():
+                mask |= m
+            for child in node.children or ():
+                mask |= check(child)
+            self.assertEqual(node.mask, mask)
+            return mask
+        self.assertEqual(check(self.tree), self.WALL | self.NPC | self.PICKUP)
+        upper_right = self.tree.children[3]
+        self.assertFalse(upper_right.mask & self.NPC)
+
+    def test_rebalance_keeps_masks(self):
+        self.tree.rebalance(8)
+        expected = {i for i, kind in self.kinds.items() if kind == self.NPC}
+        self.assertEqual(set(self.tree.intersect((0, 0, 100, 100), self.NPC)), expected)
+
+
+class TestQueryModes(unittest.TestCase):
+    def _check(self, tree, dims):
+        random.seed(99)
+        boxes = {}
+        for i in range(300):
+            low = [random.choice([50, random.uniform(0, 100)]) for _ in range(dims)]
+            extent = random.choice([0, random.uniform(0, 20)])
+            boxes[i] = low + [v + extent for v in low]
+            tree.insert(i, tuple(boxes[i]), 1 << (i % 2))
+
+        def contains(outer, inner):
+            return all(outer[d] <= inner[d] and outer[dims + d] >= inner[dims + d] for d in range(dims))
+
+        for _ in range(50):
+            low = [random.choice([50, random.uniform(0, 100)]) for _ in range(dims)]
+            query = low + [v + random.choice([0, random.uniform(0, 20)]) for v in low]
+            point = [random.choice([50, random.uniform(0, 100)]) for _ in range(dims)]
+            for mask in (-1, 2):
+                def selected(i):
+                    return (1 << (i % 2)) & mask
+                self.assertEqual(sorted(tree.within(tuple(query), mask)),
+                                 [i for i, b in boxes.items() if selected(i) and contains(query, b)])
+                self.assertEqual(sorted(tree.enclosing(tuple(query), mask)),
+                                 [i for i, b in boxes.items() if selected(i) and contains(b, query)])
+                self.assertEqual(sorted(tree.stab(tuple(point), mask)),
+                                 [i for i, b in boxes.items() if selected(i) and contains(b, point + point)])
+
+    def test_quadtree(self):
+        self._check(Quadtree((0, 0, 100, 100), capacity=4, max_depth=6), 2)
+
+    def test_octree(self):
+        self._check(Octree((0, 0, 0, 100, 100, 100), capacity=4, max_depth=6), 3)
+
+    def test_ntree(self):
+        self._check(Tree((0, 0, 0, 0, 100, 100, 100, 100), capacity=4, max_depth=4), 4)
+
+
+class TestDensity(unittest.TestCase):
+    def _expected(self, boxes, query, shape, mask):
+        dims = len(shape)
+        cells = shape[::-1]
+        grid = numpy.zeros(shape, dtype=numpy.int64)
+        for i, box in boxes.items():
+            if not (1 << (i % 2)) & mask:
+                continue
+            center = [(box[j] + box[dims + j]) / 2 for j in range(dims)]
+            if all(query[j] <= center[j] <= query[dims + j] for j in range(dims)):
+                size = [(query[dims + j] - query[j]) / cells[j] for j in range(dims)]
+                index = [min(int((center[j] - query[j]) / size[j]), cells[j] - 1) for j in range(dims)]
+                grid[tuple(reversed(index))] += 1
+        return grid
+
+    def _check_queries(self, tree, boxes, dims, shape):
+        for query in ((0,) * dims + (100,) * dims, (12.5,) * dims + (62.5,) * dims, (-20,) * dims + (40,) * dims):
+            for mask in (-1, 1):
+                self.assertTrue((tree.density(query, shape, mask) == self._expected(boxes, query, shape, mask)).all())
+
+    def _check(self, tree, dims, shape):
+        random.seed(7)
+        boxes = {}
+        for i in range(400):
+            low = [random.choice([50, 25, random.uniform(-10, 100)]) for _ in range(dims)]
+            box = tuple(low + [v + random.choice([0, random.uniform(0, 15)]) for v in low])
+            if tree.insert(i, box, 1 << (i % 2)) is not False:
+                boxes[i] = box
+            if i == 200:
+                tree.rebalance()
+            if i == 300:
+                # Counts are not maintained until the first density call, and kept up to date after it
+                self.assertIsNone(tree.count)
+                self._check_queries(tree, boxes, dims, shape)
+                self.assertEqual(tree.count, len(boxes))
+        self.assertEqual(tree.count, len(boxes))
+        self._check_queries(tree, boxes, dims, shape)
+
+    def test_quadtree(self):
+        self._check(Quadtree((0, 0, 100, 100), capacity=4, max_depth=8), 2, (8, 16))
+
+    def test_octree(self):
+        self._check(Octree((0, 0, 0, 100, 100, 100), capacity=4, max_depth=6), 3, (4, 4, 4))
+
+    def test_ntree(self):
+        self._check(Tree((0, 0, 0, 0, 100, 100, 100, 100), capacity=4, max_depth=4), 4, (2, 2, 4, 4))
+
+    def test_build_parallel(self):
+        random.seed(3)
+        boxes = {i: (x, y, x + 1, y + 1) for i, (x, y) in
+                 enumerate((random.uniform(0, 99), random.uniform(0, 99)) for _ in range(500))}
+        tree = Quadtree.build_parallel((0, 0, 100, 100), list(boxes.values()), capacity=4, workers=1)
+        query = (0, 0, 100, 100)
+        self.assertTrue((tree.density(query, (4, 4)) == self._expected(boxes, query, (4, 4), -1)).all())
+        boxes[500] = (10, 10, 11, 11)
+        tree.insert(500, boxes[500])
+        self.assertTrue((tree.density(query, (4, 4)) == self._expected(boxes, query, (4, 4), -1)).all())
+
+    def test_matches_intersect(self):
+        random.seed(11)
+        for tree in (Quadtree((0, 0, 100, 100), capacity=4), Octree((0, 0, 0, 100, 100, 100), capacity=4),
+                     Tree((0, 0, 0, 0, 100, 100, 100, 100), capacity=4)):
+            dims = len(tree.center)
+            # Items without categories are never returned, before and after the counts exist
+            for i in range(400):
+                point = [random.uniform(0, 100) for _ in range(dims)]
+                tree.insert(i, tuple(point + point), (0, 1, 2)[i % 3])
+                if i in (199, 399):
+                    for query in ((0,) * dims + (100,) * dims, (10,) * dims + (70,) * dims):
+                        for mask in (-1, 1, 2, 3):
+                            self.assertEqual(tree.density(query, (1,) * dims, mask).sum(),
+                                             len(list(tree.intersect(query, mask))))
+
+
+class TestContentBounds(unittest.TestCase):
+    def _check(self, tree, dims):
+        random.seed(11)
+        boxes = {}
+        for i in range(500):
+            cluster = random.choice([10, 80])
+            low = [random.gauss(cluster, 3) for _ in range(dims)]
+            boxes[i] = tuple(low + [v + random.choice([0, random.uniform(0, 5)]) for v in low])
+            tree.insert(i, boxes[i])
+        self.assertEqual(tree.content, tuple([max(min(b[j] for b in boxes.values()), 0) for j in range(dims)] +
+                                             [min(max(b[dims + j] for b in boxes.values()), 100)
+                                              for j in range(dims)]))
+        # Only nodes with children keep content bounds
+        self.assertTrue(all((node.content is None) == (node.children is None) for node in nodes(tree)))
+        for _ in range(100):
+            low = [random.uniform(-10, 100) for _ in range(dims)]
+            query = tuple(low + [v + random.uniform(0, 40) for v in low])
+            expected = [i for i, b in boxes.items()
+                        if all(b[j] <= query[dims + j] and b[dims + j] >= query[j] for j in range(dims))]
+            self.assertEqual(sorted(tree.intersect(query)), expected)
+            expected = [i for i, b in boxes.items()
+                        if all(b[j] >= query[j] and b[dims + j] <= query[dims + j] for j in range(dims))]
+            self.assertEqual(sorted(tree.within(query)), expected)
+
+    def test_quadtree(self):
+        self._check(Quadtree((0, 0, 100, 100), capacity=4), 2)
+
+    def test_octree(self):
+        self._check(Octree((0, 0, 0, 100, 100, 100), capacity=4), 3)
+
+    def test_build_parallel(self):
+        random.seed(5)
+        boxes = [(x, y, x + 1, y + 1) for x, y in ((random.uniform(0, 20), random.uniform(0, 20)) for _ in range(300))]
+        tree = Quadtree((0, 0, 100, 100), capacity=4)
+        for i, box in enumerate(boxes):
+            tree.insert(i, box)
+        for workers in (1, 2):
+            built = Quadtree.build_parallel((0, 0, 100, 100), boxes, capacity=4, workers=workers)
+            nodes = [(built, tree)]
+            while nodes:
+                a, b = nodes.pop()
+                self.assertEqual(a.content, b.content)
+                nodes.extend(zip(a.children or (), b.children or ()))
+
+
+class TestBuildParallel(unittest.TestCase):
+    def _check(self, cls, dims):
+        random.seed(1234)
+        bboxes = []
+        for i in range(3000):
+            low = [random.uniform(-5, 100) for _ in range(dims)]
+            if i % 7 == 0:
+                low = [50] * dims
+            extent = random.choice([0, 0, random.uniform(0, 10)])
+            bboxes.append(tuple(low + [v + extent for v in low]))
+        items = [object() for _ in bboxes]
+        masks = [1 << (i % 3) for i in range(len(bboxes))]
+        bbox = tuple([0] * dims + [100] * dims)
+        sequential = cls(bbox, capacity=4)
+        for item, rect, mask in zip(items, bboxes, masks):
+            sequential.insert(item, rect, mask)
+        for workers in (1, 2):
+            tree = cls.build_parallel(bbox, bboxes, items, capacity=4, workers=workers, masks=masks)
+            self.assertEqual(layout(tree), layout(sequential))
+            self.assertIs(tree.children[0].children[0]._config, tree._config)
+            # The entries hold the given bbox objects
+            rects = {id(item): rect for item, rect in zip(items, bboxes)}
+            self.assertTrue(all(rect is rects[id(obj)] for node in nodes(tree) for obj, rect, _ in node.points or ()))
+
+    def test_quadtree(self):
+        self._check(Quadtree, 2)
+
+    def test_octree(self):
+        self._check(Octree, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+from tree import Tree
+from tree.query_window import QueryWindow
+
+
+class TestQueryWindow(unittest.TestCase):
+    def _check(self, dims, count):
+        random.seed(1234)
+        tree = Tree(tuple([0] * dims + [100] * dims), capacity=4)
+        for i in range(count):
+            low = [random.uniform(0, 95) for _ in range(dims)]
+            extent = random.choice([0, 0, random.uniform(0, 5)])
+            tree.insert((i,), tuple(low + [v + extent for v in low]))
+        window = QueryWindow(tree)
+        position = [20.0] * dims
+        current = set()
+        for step in range(60):
+            position = [p + random.uniform(-3, 3) for p in position]
+            if step == 30:
+                position = [p + 70 for p in position]
+            bbox = tuple(position + [p + 25 for p in position])
+            entered, exited = window.move(bbox)
+            expected = set(tree.intersect(bbox))
+            self.assertEqual(entered, expected - current)
+            self.assertEqual(exited, current - expected)
+            self.assertEqual(set(window.items), expected)
+            current = expected
+
+    def test_quadtree(self):
+        self._check(2, 2000)
+
+    def test_octree(self):
+        self._check(3, 2000)
+
+    def test_ntree(self):
+        self._check(4, 300)
+
+
+if __name__ == '__main__':
+    unittest.main()
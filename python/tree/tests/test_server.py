@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import random
+import tempfile
+import threading
+import unittest
+
+from tree import Tree
+from tree.server import TreeServer, TreeClient
+
+
+class TestTreeServer(unittest.TestCase):
+    def _serve(self, tree):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        server = TreeServer(tree, os.path.join(tmp.name, "tree.sock"))
+        thread = threading.Thread(target=asyncio.run, args=(server.serve_forever(),))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.stop)
+        self.assertTrue(server.ready.wait(5))
+        return server
+
+    def _check(self, dims):
+        random.seed(1234)
+        server = self._serve(Tree(tuple([0] * dims + [100] * dims), capacity=4))
+        reference = Tree(tuple([0] * dims + [100] * dims), capacity=4)
+        boxes = {}
+        with TreeClient(server.path) as client:
+            self.assertEqual(client.dims, dims)
+            for i in range(300):
+                low = [random.uniform(0, 95) for _ in range(dims)]
+                boxes[i] = tuple(low + [v + random.uniform(0, 5) for v in low])
+                self.assertTrue(client.insert(i, boxes[i], 1 << (i % 2)))
+                reference.insert(i, boxes[i], 1 << (i % 2))
+            self.assertFalse(client.insert(300, tuple([200] * dims + [210] * dims)))
+
+            queries = []
+            for _ in range(20):
+                low = [random.uniform(0, 80) for _ in range(dims)]
+                queries.append(tuple(low + [v + 20 for v in low]))
+            for mask in (-1, 2):
+                results = client.intersect_many(queries, mask)
+                for query, ids in zip(queries, results):
+                    self.assertEqual(sorted(ids), sorted(reference.intersect(query, mask)))
+            self.assertEqual(sorted(client.intersect(queries[0])), sorted(reference.intersect(queries[0])))
+
+            point = [50.0] * dims
+
+            def distance(i):
+                box = boxes[i]
+                return sum(max(box[j] - point[j], 0, point[j] - box[dims + j]) ** 2 for j in range(dims))
+            nearest = client.nearest(point, 5, 1)
+            self.assertEqual([distance(i) for i in nearest],
+                             sorted(distance(i) for i in boxes if i % 2 == 0)[:5])
+
+    def test_quadtree(self):
+        self._check(2)
+
+    def test_ntree(self):
+        self._check(4)
+
+    def test_nearest_outside_tree(self):
+        server = self._serve(Tree((0, 0, 100, 100), capacity=1))
+        with TreeClient(server.path) as client:
+            # Both entries reach past the left border, the upper one is closer to the point
+            client.insert(1, (-55, 99, 1, 100))
+            client.insert(2, (-1, 45, 0, 46))
+            self.assertEqual(client.nearest((-60, 50), 1), [1])
+            self.assertEqual(client.nearest((-60, 50), 2), [1, 2])
+
+    def test_batch_shortcuts(self):
+        random.seed(4321)
+        tree = Tree((0, 0, 100, 100), capacity=4)
+        for i in range(2000):
+            x, y = random.uniform(0, 99), random.uniform(0, 99)
+            tree.insert(i, (x, y, x + random.uniform(0, 1), y + random.uniform(0, 1)), 1 << (i % 3))
+        server = TreeServer(tree, "unused.sock")
+        # Nested and overlapping queries, some containing whole subtrees
+        queries = [((10 + j, 10 + j, 60 + j, 60 + 2 * j), mask) for j in range(10) for mask in (-1, 1, 6)]
+        queries.append(((-10, -10, 110, 110), -1))
+        for (bbox, mask), ids in zip(queries, server._intersect_batch(queries)):
+            self.assertEqual(len(ids), len(set(ids)))
+            self.assertEqual(sorted(ids), sorted(tree.intersect(bbox, mask)))
+
+    def test_concurrent_clients(self):
+        server = self._serve(Tree((0, 0, 100, 100)))
+        with TreeClient(server.path) as client:
+            for i in range(100):
+                client.insert(i, (i, i, i, i))
+        errors = []
+
+        def work(offset):
+            with TreeClient(server.path) as client:
+                for i in range(50):
+                    x = (i + offset) % 90
+                    if sorted(client.intersect((x, x, x + 10, x + 10))) != list(range(x, x + 11)):
+                        errors.append(x)
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_failed_requests(self):
+        tree = Tree((0, 0, 100, 100))
+        tree.insert("not an id", (10, 10, 20, 20))
+        server = self._serve(tree)
+        with TreeClient(server.path) as client:
+            self.assertTrue(client.insert(1, (50, 50, 60, 60)))
+            with self.assertLogs("tree.server", "ERROR"):
+                with self.assertRaisesRegex(RuntimeError, "not an integer"):
+                    client.intersect_many([(0, 0, 30, 30), (40, 40, 70, 70)])
+                with self.assertRaisesRegex(RuntimeError, "Unknown operation 7"):
+                    client._request([(7, -1, 0, (0, 0, 1, 1))])
+            # The server keeps answering after a failure
+            self.assertEqual(client.intersect((40, 40, 70, 70)), [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+import os
+import random
+import tempfile
+import unittest
+
+from tree import Tree
+from tree.tiled_index import TiledIndex
+
+
+class TestTiledIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        random.seed(1234)
+        self.entries = []
+        for i in range(3000):
+            x, y = random.uniform(0, 1000), random.uniform(0, 1000)
+            w = random.choice([0, 0, random.uniform(0, 80)])
+            self.entries.append((i, (x, y, x + w, y + w)))
+        self.reference = Tree((0, 0, 1000, 1000), capacity=4)
+        for item, bbox in self.entries:
+            self.reference.insert(item, bbox)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _queries(self, index):
+        for _ in range(100):
+            x, y = random.uniform(-50, 1000), random.uniform(-50, 1000)
+            bbox = (x, y, x + random.uniform(0, 300), y + random.uniform(0, 300))
+            result = list(index.intersect(bbox))
+            self.assertEqual(len(result), len(set(result)))
+            self.assertEqual(sorted(result), sorted(self.reference.intersect(bbox)))
+
+    def test_budget_and_queries(self):
+        index = TiledIndex(self.tmp.name, (0, 0, 1000, 1000), tiles=(8, 8), max_bytes=20000, capacity=4)
+        for item, bbox in self.entries:
+            index.insert(item, bbox)
+            self.assertTrue(len(index._resident) == 1 or index.resident_bytes <= index.max_bytes)
+        self._queries(index)
+        self.assertLess(len(index._resident), 64)
+
+    def test_reopen(self):
+        with TiledIndex(self.tmp.name, (0, 0, 1000, 1000), tiles=(4, 4), capacity=4) as index:
+            for item, bbox in self.entries:
+                index.insert(item, bbox)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, "tile_0_0.pickle")))
+        index = TiledIndex.open(self.tmp.name, max_bytes=50000)
+        self.assertEqual(len(index._resident), 0)
+        self._queries(index)
+        self.assertFalse(index.insert(-1, (2000, 2000, 2001, 2001)))
+
+    def test_existing_directory(self):
+        index = TiledIndex(self.tmp.name, (0, 0, 1000, 1000), tiles=(4, 4))
+        index.insert("old", (10, 10, 20, 20))
+        index.flush()
+        with self.assertRaisesRegex(FileExistsError, "TiledIndex.open"):
+            TiledIndex(self.tmp.name, (0, 0, 1000, 1000), tiles=(4, 4))
+        os.remove(os.path.join(self.tmp.name, "index.pickle"))
+        with self.assertRaises(FileExistsError):
+            TiledIndex(self.tmp.name, (0, 0, 1000, 1000), tiles=(4, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
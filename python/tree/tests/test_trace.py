@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import io
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+from tree import Tree
+from tree.id_quadtree import IdQuadtree
+from tree.linear_quadtree import LinearQuadtree
+from tree.trace import TraceRecorder, load_trace, main, replay, INSERT, INTERSECT, STAB
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "workload.trace")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_record_and_replay(self):
+        random.seed(1234)
+        with TraceRecorder(Tree((0, 0, 100, 100), capacity=4), self.path) as tree:
+            boxes = []
+            for i in range(200):
+                x, y = random.uniform(0, 95), random.uniform(0, 95)
+                boxes.append((x, y, x + 5, y + 5))
+                tree.insert(i, boxes[-1], 1 << (i % 2))
+            counts = [len(list(tree.intersect((10, 10, 40, 40))))]
+            counts.append(len(list(tree.stab((50, 50), 2))))
+            query = tree.intersect((0, 0, 100, 100))
+            next(query)
+            query.close()
+            tree.rebalance()
+
+        bbox, entries = load_trace(self.path)
+        self.assertEqual(bbox, (0, 0, 100, 100))
+        self.assertEqual([e.op for e in entries], [INSERT] * 200 + [INTERSECT, STAB, INTERSECT])
+        self.assertEqual([e.bbox for e in entries[:200]], boxes)
+        self.assertEqual([e.mask for e in entries[:3]], [1, 2, 1])
+        # Queries are run to completion on their first item
+        self.assertEqual([e.count for e in entries[200:]], counts + [200])
+        self.assertEqual(entries[201].bbox, (50, 50, 50, 50))
+
+        report = replay(self.path, lambda b: Tree(b, capacity=8, max_depth=6))
+        self.assertEqual(sorted(report), ["insert", "intersect", "stab"])
+        self.assertEqual(report["insert"]["n"], 200)
+        self.assertEqual(report["intersect"]["results"], counts[0] + 200)
+        self.assertEqual(report["stab"]["results"], counts[1])
+        self.assertLessEqual(report["intersect"]["p50"], report["intersect"]["max"])
+
+    def test_replay_id_tree(self):
+        with TraceRecorder(Tree((0, 0, 100, 100)), self.path) as tree:
+            for i in range(50):
+                tree.insert(i, (i, i, i + 1, i + 1))
+            list(tree.intersect((0, 0, 10, 10)))
+        report = replay(self.path, IdQuadtree)
+        self.assertEqual(report["intersect"]["results"], 11)
+
+    def test_replay_unsupported(self):
+        with TraceRecorder(Tree((0, 0, 100, 100)), self.path) as tree:
+            for i in range(50):
+                tree.insert(i, (i, i, i + 1, i + 1))
+            list(tree.stab((5.5, 5.5)))
+        with self.assertRaisesRegex(ValueError, "LinearQuadtree does not support stab"):
+            replay(self.path, LinearQuadtree)
+        self.assertEqual(replay(self.path, IdQuadtree)["stab"]["results"], 1)
+
+        with TraceRecorder(Tree((0, 0, 100, 100)), self.path) as tree:
+            tree.insert(0, (1, 1, 2, 2), 2)
+        with self.assertRaisesRegex(ValueError, "IdQuadtree does not support insert with a mask"):
+            replay(self.path, IdQuadtree)
+
+    def test_engine_dimensions(self):
+        with TraceRecorder(Tree((0, 0, 0, 100, 100, 100)), self.path) as tree:
+            tree.insert(0, (1, 1, 1, 2, 2, 2))
+        for engine in ("ids", "linear"):
+            with mock.patch("sys.stderr", io.StringIO()) as stderr, self.assertRaises(SystemExit):
+                main([self.path, "--engine", engine])
+            self.assertIn("--engine %s only replays 2D traces" % engine, stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
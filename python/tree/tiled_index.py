@@ -0,0 +1,233 @@
+import itertools
+import math
+import os
+import pickle
+from collections import OrderedDict
+from typing import Tuple, Optional, Iterator
+
+from .tree import Tree
+
+METADATA_FILE = "index.pickle"
+
+
+class TiledIndex:
+    """Index over a world larger than memory, split into a fixed grid of independent trees.
+
+    Each tile of the grid is a Quadtree (2D), Octree (3D) or NTree stored in its own
+    file in a directory. Tiles are loaded when an insert or query touches them and the
+    least recently used tiles are written back and dropped once the resident tiles
+    exceed a budget in bytes. A query fans out over the tiles it covers, and items
+    spanning several tiles are only returned once.
+
+    How to use:
+        index = TiledIndex("world", (0, 0, 65536, 65536), tiles=(64, 64), max_bytes=2**30)
+        index.insert(house, (100, 100, 120, 130))
+        for obj in index.intersect((0, 0, 512, 512)):
+            <do things>
+        index.close()
+
+        index = TiledIndex.open("world")
+    """
+
+    def __init__(self, directory: str, bbox: Tuple[float, ...], tiles: Tuple[int, ...],
+                 max_bytes: int = 256 * 2 ** 20, capacity: int = 10, max_depth: int = 20):
+        """
+        Args:
+            directory: Directory holding the tile files, created if missing
+            bbox: Bounding box of the whole world
+            tiles: Number of tiles along each dimension
+            max_bytes: Budget for the serialized size of the tiles kept in memory
+            capacity: Capacity of each branch of the tile trees (default: 10)
+            max_depth: Maximum depth of the tile trees
+        Raises:
+            FileExistsError: If the directory already holds an index or tile files
+        """
+        assert len(bbox) == 2 * len(tiles)
+        os.makedirs(directory, exist_ok=True)
+        # Keys of a new index restart at 0 and would collide with the items of old tiles
+        if any(name == METADATA_FILE or (name.startswith("tile_") and name.endswith(".pickle"))
+               for name in os.listdir(directory)):
+            raise FileExistsError("%s already holds an index, use TiledIndex.open to reopen it" % directory)
+        self._setup(directory, bbox, tiles, max_bytes, capacity, max_depth)
+
+    def _setup(self, directory, bbox, tiles, max_bytes, capacity, max_depth):
+        self.directory = directory
+        self.bbox = tuple(bbox)
+        self.tiles = tuple(tiles)
+        self.max_bytes = max_bytes
+        self._capacity = capacity
+        self._max_depth = max_depth
+        self._dims = len(tiles)
+        self._tile_size = tuple((bbox[self._dims + j] - bbox[j]) / tiles[j] for j in range(self._dims))
+        # Items are stored as (key, item) so copies loaded from different tiles can be matched
+        self._next_key = 0
+        self._counts = {}
+        # Running estimate of the serialized size of one entry
+        self._entry_bytes = 100.0
+        self._resident = OrderedDict()
+        self._sizes = {}
+        self._resident_bytes = 0.0
+        self._dirty = set()
+
+    @classmethod
+    def open(cls, directory: str, max_bytes: int = 256 * 2 ** 20) -> "TiledIndex":
+        """Opens an index previously written to a directory.
+
+        Args:
+            directory: Directory holding the tile files
+            max_bytes: Budget for the serialized size of the tiles kept in memory
+        """
+        with open(os.path.join(directory, METADATA_FILE), "rb") as f:
+            metadata = pickle.load(f)
+        index = cls.__new__(cls)
+        index._setup(directory, metadata["bbox"], metadata["tiles"], max_bytes,
+                     metadata["capacity"], metadata["max_depth"])
+        index._next_key = metadata["next_key"]
+        index._counts = metadata["counts"]
+        index._entry_bytes = metadata["entry_bytes"]
+        return index
+
+    def insert(self, item, bbox: Tuple[float, ...], mask: int = -1):
+        """
+        Insert an item into every tile its bounding box overlaps.
+
+        Args:
+            item:  Data to connect to this bounding box
+            bbox:  Bounding box of the item
+            mask:  Category bits of the item (default: all categories)
+        Returns:
+            False if the bounding box is outside the index
+        """
+        tiles = self._covered(bbox)
+        if not tiles:
+            return False
+        entry = (self._next_key, item)
+        self._next_key += 1
+        for index in tiles:
+            self._tile(index, create=True).insert(entry, bbox, mask)
+            self._dirty.add(index)
+            self._counts[index] = self._counts.get(index, 0) + 1
+            self._sizes[index] += self._entry_bytes
+            self._resident_bytes += self._entry_bytes
+        self._evict()
+
+    def intersect(self, bbox: Tuple[float, ...], mask: int = -1) -> Iterator:
+        """
+        Creates a generator query of a rectangular region, loading the covered tiles.
+
+        Args:
+            bbox: tuple of intersection bounding box
+            mask: Only yield items whose mask shares a bit with this mask (default: all items)
+
+        Returns:
+            A generator object corresponding to the query
+        """
+        seen = set()
+        for index in self._covered(bbox):
+            tile = self._tile(index, create=False)
+            if tile is None:
+                continue
+            for key, obj in tile.intersect(bbox, mask):
+                if key not in seen:
+                    seen.add(key)
+                    yield obj
+
+    def flush(self):
+        """Writes all modified tiles and the index metadata to the directory."""
+        for index in list(self._dirty):
+            self._save(index)
+        metadata = {
+            "bbox": self.bbox,
+            "tiles": self.tiles,
+            "capacity": self._capacity,
+            "max_depth": self._max_depth,
+            "next_key": self._next_key,
+            "counts": self._counts,
+            "entry_bytes": self._entry_bytes,
+        }
+        self._write(os.path.join(self.directory, METADATA_FILE), pickle.dumps(metadata))
+
+    def close(self):
+        """Flushes the index and drops all resident tiles."""
+        self.flush()
+        self._resident.clear()
+        self._sizes.clear()
+        self._resident_bytes = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def resident_bytes(self) -> int:
+        """Estimated serialized size of the tiles currently in memory."""
+        return int(self._resident_bytes)
+
+    def _covered(self, bbox):
+        """Indices of the tiles whose region overlaps bbox."""
+        dims = self._dims
+        ranges = []
+        for j in range(dims):
+            low = self.bbox[j]
+            size = self._tile_size[j]
+            first = max(math.floor((bbox[j] - low) / size) - 1, 0)
+            last = min(math.floor((bbox[dims + j] - low) / size) + 1, self.tiles[j] - 1)
+            ranges.append([i for i in range(first, last + 1)
+                           if low + i * size <= bbox[dims + j] and low + (i + 1) * size >= bbox[j]])
+        return list(itertools.product(*ranges))
+
+    def _tile(self, index, create: bool) -> Optional[object]:
+        """Returns a tile, loading it from disk or creating it if needed."""
+        tile = self._resident.get(index)
+        if tile is not None:
+            self._resident.move_to_end(index)
+            return tile
+        path = self._path(index)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+            tile = pickle.loads(data)
+            self._sizes[index] = len(data)
+        elif create:
+            dims = self._dims
+            low = [self.bbox[j] + index[j] * self._tile_size[j] for j in range(dims)]
+            high = [self.bbox[j] + (index[j] + 1) * self._tile_size[j] for j in range(dims)]
+            tile = Tree((*low, *high), self._capacity, self._max_depth)
+            self._sizes[index] = 0
+        else:
+            return None
+        self._resident[index] = tile
+        self._resident_bytes += self._sizes[index]
+        self._evict()
+        return tile
+
+    def _evict(self):
+        """Writes back and drops least recently used tiles until the budget is met."""
+        while len(self._resident) > 1 and self._resident_bytes > self.max_bytes:
+            index = next(iter(self._resident))
+            if index in self._dirty:
+                self._save(index)
+            del self._resident[index]
+            self._resident_bytes -= self._sizes.pop(index)
+
+    def _save(self, index):
+        data = pickle.dumps(self._resident[index], protocol=pickle.HIGHEST_PROTOCOL)
+        self._write(self._path(index), data)
+        self._dirty.discard(index)
+        self._resident_bytes += len(data) - self._sizes[index]
+        self._sizes[index] = len(data)
+        if self._counts.get(index):
+            self._entry_bytes = len(data) / self._counts[index]
+
+    @staticmethod
+    def _write(path, data: bytes):
+        # Write to a temporary file first so a crash never leaves a truncated tile
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _path(self, index) -> str:
+        return os.path.join(self.directory, "tile_%s.pickle" % "_".join(map(str, index)))
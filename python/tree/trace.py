@@ -0,0 +1,262 @@
+import argparse
+import inspect
+import struct
+import time
+from typing import Tuple, Optional, List, NamedTuple, Callable, Dict
+
+import numpy
+
+MAGIC = b"QTRC"
+VERSION = 1
+
+INSERT, INTERSECT, WITHIN, STAB, ENCLOSING = range(5)
+OPERATIONS = ("insert", "intersect", "within", "stab", "enclosing")
+
+_HEADER = struct.Struct("<4sBB")
+# Operation, duration in nanoseconds, result count and mask, followed by the bounding box
+_RECORD = struct.Struct("<BQIq")
+
+
+class TraceEntry(NamedTuple):
+    op: int
+    duration_ns: int
+    count: int
+    mask: int
+    bbox: Tuple[float, ...]
+
+
+class TraceRecorder:
+    """Wraps a tree and logs every insert and query made through it to a binary trace file.
+
+    Each entry holds the operation, its bounding box (a point is stored as a degenerate
+    box), its mask, the time spent inside the tree and the number of results. A query is
+    run to completion when the caller asks for its first item, timed as a whole, and its
+    results are then handed out from a list, so the time spent by the caller between two
+    items is not counted. Entries are fixed size and written through a buffered file, so
+    recording costs two clock reads and a struct pack per operation.
+
+    Works on Quadtree, Octree and NTree. Any other attribute is forwarded to the tree, so
+    the recorder can replace the tree in existing code.
+
+    How to use:
+        with TraceRecorder(tree, "workload.trace") as tree:
+            tree.insert(player, (90, 90, 110, 110))
+            for obj in tree.intersect((0, 0, 100, 100)):
+                <do things>
+
+        python -m tree.trace workload.trace --capacity 16
+    """
+
+    def __init__(self, tree, path: str):
+        """
+        Args:
+            tree: Tree to record
+            path: File the trace is written to, overwritten if it exists
+        """
+        self._tree = tree
+        root = numpy.ravel(tree.bbox).tolist()
+        self._width = len(root)
+        self._file = open(path, "wb")
+        self._file.write(_HEADER.pack(MAGIC, VERSION, len(root) // 2))
+        self._file.write(struct.pack("<%dd" % len(root), *root))
+        # Bound once, every operation packs its whole entry with a single call
+        self._pack = struct.Struct(_RECORD.format + "%dd" % len(root)).pack
+        self._write_bytes = self._file.write
+
+    def insert(self, item, bbox: Tuple[float, ...], mask: int = -1):
+        clock = time.perf_counter_ns
+        start = clock()
+        result = self._tree.insert(item, bbox, mask)
+        self._write(INSERT, clock() - start, result is not False, mask, bbox)
+        return result
+
+    def intersect(self, bbox: Tuple[float, ...], mask: int = -1):
+        return self._traced(INTERSECT, self._tree.intersect(bbox, mask), mask, bbox)
+
+    def within(self, bbox: Tuple[float, ...], mask: int = -1):
+        return self._traced(WITHIN, self._tree.within(bbox, mask), mask, bbox)
+
+    def stab(self, point: Tuple[float, ...], mask: int = -1):
+        return self._traced(STAB, self._tree.stab(point, mask), mask, (*point, *point))
+
+    def enclosing(self, bbox: Tuple[float, ...], mask: int = -1):
+        return self._traced(ENCLOSING, self._tree.enclosing(bbox, mask), mask, bbox)
+
+    def close(self):
+        """Flushes and closes the trace file."""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._tree, name)
+
+    def _traced(self, op: int, query, mask: int, bbox):
+        """Runs query once its first item is requested, records it and yields its results."""
+        clock = time.perf_counter_ns
+        start = clock()
+        results = list(query)
+        self._write(op, clock() - start, len(results), mask, bbox)
+        yield from results
+
+    def _write(self, op: int, duration_ns: int, count: int, mask: int, bbox):
+        if not -2 ** 63 <= mask < 2 ** 63:
+            # Masks are stored as signed 64 bit integers, so -1 stays "all categories"
+            mask = (mask + 2 ** 63) % 2 ** 64 - 2 ** 63
+        if len(bbox) != self._width:
+            bbox = numpy.ravel(bbox).tolist()
+        self._write_bytes(self._pack(op, duration_ns, count, mask, *bbox))
+
+
+def load_trace(path: str) -> Tuple[Tuple[float, ...], List[TraceEntry]]:
+    """Reads a trace written by TraceRecorder.
+
+    Args:
+        path: Trace file
+    Returns:
+        Tuple (bbox, entries) with the bounding box of the recorded tree and the entries
+        in the order they were recorded
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    dims = _unpack_header(data, path)
+    bbox_struct = struct.Struct("<%dd" % (2 * dims))
+    bbox = bbox_struct.unpack_from(data, _HEADER.size)
+    entries = []
+    offset = _HEADER.size + bbox_struct.size
+    while offset < len(data):
+        op, duration_ns, count, mask = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        entries.append(TraceEntry(op, duration_ns, count, mask, bbox_struct.unpack_from(data, offset)))
+        offset += bbox_struct.size
+    return bbox, entries
+
+
+def replay(path: str, factory: Optional[Callable] = None,
+           percentiles: Tuple[float, ...] = (50, 90, 99)) -> Dict[str, Dict[str, float]]:
+    """Runs a recorded trace against a new tree and measures the latency of each operation.
+
+    Inserted items are replaced by their insertion index, so trees storing integer ids
+    can be replayed as well. Masks are only passed on when they select a subset of the
+    categories, trees without category support can then replay traces which never used
+    them. Queries are timed until their results are exhausted. The trace is checked
+    against the tree before replaying, so a tree lacking an operation or mask support
+    used by the trace fails up front instead of reporting misleading latencies.
+
+    Args:
+        path: Trace file
+        factory: Called with the recorded tree bounding box to create the tree to replay
+                 against (default: Tree with default capacity and max_depth)
+        percentiles: Latency percentiles to report
+    Returns:
+        Dictionary from operation name to its statistics: number of operations "n",
+        total number of results "results" and latencies in microseconds as "p<percentile>"
+        and "max". Operations missing from the trace are left out.
+    Raises:
+        ValueError: If the tree does not support an operation or mask used by the trace
+    """
+    if factory is None:
+        from .tree import Tree
+        factory = Tree
+    bbox, entries = load_trace(path)
+    tree = factory(bbox)
+    _check_support(tree, entries)
+    dims = len(bbox) // 2
+    latencies = [[] for _ in OPERATIONS]
+    results = [0] * len(OPERATIONS)
+    clock = time.perf_counter_ns
+    for index, entry in enumerate(entries):
+        args = (entry.mask,) if entry.mask != -1 else ()
+        if entry.op == INSERT:
+            start = clock()
+            tree.insert(index, entry.bbox, *args)
+            count = 1
+        else:
+            query = getattr(tree, OPERATIONS[entry.op])
+            target = entry.bbox[:dims] if entry.op == STAB else entry.bbox
+            start = clock()
+            count = len(list(query(target, *args)))
+        latencies[entry.op].append(clock() - start)
+        results[entry.op] += count
+
+    report = {}
+    for op, name in enumerate(OPERATIONS):
+        if not latencies[op]:
+            continue
+        micros = numpy.array(latencies[op]) / 1000
+        stats = {"n": len(micros), "results": results[op]}
+        for p, value in zip(percentiles, numpy.percentile(micros, percentiles)):
+            stats["p%g" % p] = float(value)
+        stats["max"] = float(micros.max())
+        report[name] = stats
+    return report
+
+
+def _unpack_header(data: bytes, path: str) -> int:
+    """Checks the header of a trace and returns its number of dimensions."""
+    if len(data) < _HEADER.size:
+        raise ValueError("%s is not a version %d trace file" % (path, VERSION))
+    magic, version, dims = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("%s is not a version %d trace file" % (path, VERSION))
+    return dims
+
+
+def _check_support(tree, entries: List[TraceEntry]):
+    """Raises ValueError if the trace uses operations or masks the tree does not support."""
+    used = set()
+    masked = set()
+    for entry in entries:
+        used.add(entry.op)
+        if entry.mask != -1:
+            masked.add(entry.op)
+    missing = []
+    for op in sorted(used):
+        method = getattr(tree, OPERATIONS[op], None)
+        if method is None:
+            missing.append(OPERATIONS[op])
+        elif op in masked and "mask" not in inspect.signature(method).parameters:
+            missing.append("%s with a mask" % OPERATIONS[op])
+    if missing:
+        raise ValueError("%s does not support %s used by the trace" %
+                         (type(tree).__name__, ", ".join(missing)))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Replay a recorded tree workload and report latencies.")
+    parser.add_argument("trace", help="Trace file written by TraceRecorder")
+    parser.add_argument("--capacity", type=int, default=10, help="Capacity of each branch")
+    parser.add_argument("--max-depth", type=int, default=20, help="Maximum depth of the tree")
+    parser.add_argument("--engine", choices=("tree", "ids", "linear"), default="tree",
+                        help="Tree implementation: Quadtree/Octree/NTree, IdQuadtree or LinearQuadtree")
+    args = parser.parse_args(argv)
+
+    if args.engine == "ids":
+        from .id_quadtree import IdQuadtree as engine
+    elif args.engine == "linear":
+        from .linear_quadtree import LinearQuadtree as engine
+    else:
+        from .tree import Tree as engine
+    try:
+        with open(args.trace, "rb") as f:
+            dims = _unpack_header(f.read(_HEADER.size), args.trace)
+        # IdQuadtree and LinearQuadtree are two dimensional only
+        if args.engine != "tree" and dims != 2:
+            raise ValueError("--engine %s only replays 2D traces, %s is %dD" % (args.engine, args.trace, dims))
+        report = replay(args.trace, lambda bbox: engine(bbox, args.capacity, args.max_depth))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    columns = [key for key in next(iter(report.values()), {}) if key not in ("n", "results")]
+    print("%-10s %8s %10s" % ("operation", "n", "results") + "".join(" %9s" % c for c in columns))
+    for name, stats in report.items():
+        print("%-10s %8d %10d" % (name, stats["n"], stats["results"]) +
+              "".join(" %9.1f" % stats[c] for c in columns))
+
+
+if __name__ == "__main__":
+    main()
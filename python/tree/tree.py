@@ -62,13 +62,14 @@ class Tree(abc.ABC):
         return NTree(bbox, capacity, max_depth)
 
     @abc.abstractmethod
-    def insert(self, data, bbox):
+    def insert(self, data, bbox, mask: int = -1):
         """
         Insert a point into the quadtree.
 
         Args:
             data:  Data to connect to this bounding box
             bbox:  Tuple with same dimension as the tree
+            mask:  Category bits of the item, e.g. one bit per layer (default: all categories)
         Returns:
             True if bounding box is inside the quadtree region, False otherwise
 
@@ -76,13 +77,91 @@ class Tree(abc.ABC):
         """
 
     @abc.abstractmethod
-    def intersect(self, bbox: Tuple[float, ...]):
+    def intersect(self, bbox: Tuple[float, ...], mask: int = -1):
         """
         Creates a generator query of a rectangular region within the quadtree.
 
+        Every node keeps the OR of the masks stored below it, so subtrees without any
+        item of the queried categories are skipped.
+
         Args:
             bbox: tuple of intersection bounding box
+            mask: Only yield items whose mask shares a bit with this mask (default: all items)
+
+        Returns:
+            A generator object corresponding to the query
+        """
+
+    @abc.abstractmethod
+    def within(self, bbox: Tuple[float, ...], mask: int = -1):
+        """
+        Creates a generator query of the items lying entirely inside a rectangular region.
+
+        Args:
+            bbox: tuple of query bounding box
+            mask: Only yield items whose mask shares a bit with this mask (default: all items)
 
         Returns:
             A generator object corresponding to the query
         """
+
+    @abc.abstractmethod
+    def stab(self, point: Tuple[float, ...], mask: int = -1):
+        """
+        Creates a generator query of the items whose bounding box contains a point.
+
+        Only a single child is visited per level, following the side of each split
+        the point falls on.
+
+        Args:
+            point: tuple of query point, with half the dimension of the tree bounding box
+            mask: Only yield items whose mask shares a bit with this mask (default: all items)
+
+        Returns:
+            A generator object corresponding to the query
+        """
+
+    @abc.abstractmethod
+    def enclosing(self, bbox: Tuple[float, ...], mask: int = -1):
+        """
+        Creates a generator query of the items whose bounding box contains a rectangular region.
+
+        Args:
+            bbox: tuple of query bounding box
+            mask: Only yield items whose mask shares a bit with this mask (default: all items)
+
+        Returns:
+            A generator object corresponding to the query
+        """
+
+    @abc.abstractmethod
+    def density(self, bbox: Tuple[float, ...], shape: Tuple[int, ...], mask: int = -1):
+        """
+        Counts the items in each cell of a grid laid over a rectangular region.
+
+        Each item is counted once, in the cell containing the center of its bounding box.
+        Every node keeps the number of items centered in it, so nodes lying within a
+        single cell are counted without visiting their items.
+
+        Args:
+            bbox: tuple of the region covered by the grid
+            shape: Number of cells along each dimension, last dimension first,
+                   e.g. (rows, columns) for a Quadtree
+            mask: Only count items whose mask shares a bit with this mask (default: all items)
+
+        Returns:
+            A numpy int64 array of the given shape with the item count of each cell
+        """
+
+    @abc.abstractmethod
+    def rebalance(self, capacity: int = None):
+        """
+        Rebuild the tree from the items currently stored in it.
+
+        Leaves holding more than `capacity` items that no split can separate are kept
+        as overflow buckets instead of being split. Rebalancing drops nodes left empty
+        by earlier splits.
+
+        Args:
+            capacity: New capacity of each branch (default: keep the current capacity)
+        """